@@ -180,6 +180,10 @@ class Metric(object):
     tmp_cache_keys: The set to track what temporary cache_keys are used during
       computation when default caching is enabled. When computation is done, all
       the keys in tmp_cache_keys are flushed.
+    shared_groupby: None, or a tuple of a DataFrame, a split_by tuple and the
+      GroupBy of them. It's set by an ancestor MetricList during its computation
+      so the descendants grouping the same DataFrame by the same split_by reuse
+      the GroupBy.
   """
   RESERVED_KEY = '_RESERVED'
 
@@ -217,6 +221,7 @@ class Metric(object):
     if final_compute:
       self.final_compute = final_compute
     self.tmp_cache_keys = set()
+    self.shared_groupby = None
 
   def compute_with_split_by(self,
                             df,
@@ -426,9 +431,20 @@ class Metric(object):
       res = utils.apply_name_tmpl(self.name_tmpl, res, melted)
     return utils.remove_empty_level(res)
 
-  @staticmethod
-  def group(df, split_by=None):
-    return df.groupby(split_by) if split_by else df
+  def group(self, df, split_by=None):
+    if not split_by:
+      return df
+    shared = self.get_shared_groupby(df, split_by)
+    return df.groupby(split_by) if shared is None else shared
+
+  def get_shared_groupby(self, df, split_by):
+    """Gets the GroupBy of df by split_by shared by a MetricList, if any."""
+    if self.shared_groupby is None:
+      return None
+    shared_df, shared_split_by, grouped = self.shared_groupby
+    if shared_df is df and shared_split_by == tuple(split_by):
+      return grouped
+    return None
 
   def to_dataframe(self, res):
     if isinstance(res, pd.DataFrame):
@@ -821,22 +837,37 @@ class MetricList(Metric):
     """
     res = []
     key = self.cache_key or self.RESERVED_KEY
-    for m in self:
-      try:
-        child = m.compute_on(
-            df,
-            split_by,
-            return_dataframe=self.children_return_dataframe,
-            cache_key=key)
-        if isinstance(child, pd.DataFrame):
-          if self.name_tmpl:
-            child.columns = [self.name_tmpl.format(c) for c in child.columns]
-        if isinstance(child, pd.Series):
-          if self.name_tmpl:
-            child.name = self.name_tmpl.format(child.name)
-        res.append(child)
-      except Exception as e:  # pylint: disable=broad-except
-        print('Warning: %s failed for reason %s.' % (m.name, repr(e)))
+    # The descendants grouping the same df by the same split_by share one
+    # GroupBy so the grouping keys are only factorized once.
+    share = isinstance(df, pd.DataFrame) and split_by and (
+        self.get_shared_groupby(df, split_by) is None)
+    if share:
+      shared = (df, tuple(split_by), df.groupby(split_by))
+      descendants = list(self.traverse())
+      previous = [m.shared_groupby for m in descendants]
+      for m in descendants:
+        m.shared_groupby = shared
+    try:
+      for m in self:
+        try:
+          child = m.compute_on(
+              df,
+              split_by,
+              return_dataframe=self.children_return_dataframe,
+              cache_key=key)
+          if isinstance(child, pd.DataFrame):
+            if self.name_tmpl:
+              child.columns = [self.name_tmpl.format(c) for c in child.columns]
+          if isinstance(child, pd.Series):
+            if self.name_tmpl:
+              child.name = self.name_tmpl.format(child.name)
+          res.append(child)
+        except Exception as e:  # pylint: disable=broad-except
+          print('Warning: %s failed for reason %s.' % (m.name, repr(e)))
+    finally:
+      if share:
+        for m, p in zip(descendants, previous):
+          m.shared_groupby = p
     return res
 
   def get_sql_and_with_clause(self, table, split_by, global_filter, indexes,
@@ -1251,6 +1251,42 @@ class TestMetricList(unittest.TestCase):
         }, columns=['sum(X)', 'mean(X)'])
     testing.assert_frame_equal(output, expected)
 
+  def test_children_share_groupby(self):
+    df = pd.DataFrame({'X': [0, 1, 2, 3], 'grp': ['A', 'A', 'B', 'B']})
+    ms = [metrics.Sum('X'), metrics.Count('X'), metrics.Mean('X')]
+    with mock.patch.object(
+        df, 'groupby', wraps=df.groupby, autospec=True) as mock_fn:
+      output = metrics.MetricList(ms).compute_on(df, 'grp')
+      mock_fn.assert_called_once()
+    expected = pd.concat([m.compute_on(df, 'grp') for m in ms], axis=1)
+    testing.assert_frame_equal(output, expected)
+    for m in ms:
+      self.assertIsNone(m.shared_groupby)
+
+  def test_nested_children_share_groupby(self):
+    df = pd.DataFrame({'X': [0, 1, 2, 3], 'grp': ['A', 'A', 'B', 'B']})
+    ms = [metrics.Sum('X'), metrics.MetricList([metrics.Count('X')])]
+    m = metrics.MetricList(ms)
+    with mock.patch.object(
+        df, 'groupby', wraps=df.groupby, autospec=True) as mock_fn:
+      output = m.compute_on(df, 'grp')
+      mock_fn.assert_called_once()
+    expected = pd.concat([c.compute_on(df, 'grp') for c in ms], axis=1)
+    testing.assert_frame_equal(output, expected)
+    for c in m.traverse():
+      self.assertIsNone(c.shared_groupby)
+
+  def test_shared_groupby_reset_on_error(self):
+    df = pd.DataFrame({'X': [0, 1, 2, 3], 'grp': ['A', 'A', 'B', 'B']})
+    sum_x = metrics.Sum('X')
+    m = metrics.MetricList([sum_x])
+    with mock.patch.object(
+        sum_x, 'compute_on', side_effect=KeyboardInterrupt, autospec=True):
+      with self.assertRaises(KeyboardInterrupt):
+        m.compute_on(df, 'grp')
+    self.assertIsNone(m.shared_groupby)
+    self.assertIsNone(sum_x.shared_groupby)
+
   def test_with_name_tmpl(self):
     df = pd.DataFrame({'X': [0, 1, 2, 3]})
     ms = [metrics.Sum('X'), metrics.Mean('X')]
@@ -17,6 +17,8 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import copy
+import functools
 import itertools
 from typing import List, Optional, Sequence, Text, Union
 
@@ -26,10 +28,11 @@ from meterstick import sql
 from meterstick import utils
 import numpy as np
 import pandas as pd
+from scipy import linalg
 from sklearn import linear_model
 
 
-def get_data(m, table, split_by, execute, normalize=False):
+def get_data(m, table, split_by, normalize=False):
   """Retrieves the data that the model will be fit on.
 
   We compute a Model by first computing its children, and then fitting
@@ -40,21 +43,22 @@ def get_data(m, table, split_by, execute, normalize=False):
     m: A Model instance.
     table: The table we want to query from.
     split_by: The columns that we use to split the data.
-    execute: A function that can executes a SQL query and returns a DataFrame.
     normalize: If the Model normalizes x.
 
   Returns:
     table: A string representing the table name which we can query from. The
       table has columns `split_by`, y, x1, x2, .... If normalize is True, x
-      columns are centered then normalized.
+      columns are centered then normalized, and the table also has the columns
+      in avgs and norms.
     with_data: The WITH clause that holds all necessary subqueries so we can
       query the `table`.
     xs: A list of the column names of x1, x2, ...
     y: The column name of the y column.
-    avgs: Nonempty only when normalize is True. A pd.DataFrame which holds the
-      average of all x and y columns.
-    norms: Nonempty only when normalize is True. A pd.DataFrame which holds the
-      l2-norm values of all centered-x columns.
+    avgs: Nonempty only when normalize is True. A list of the column names in
+      `table` that hold the averages of all x and y columns in each slice,
+      before the centering.
+    norms: Nonempty only when normalize is True. A list of the column names in
+      `table` that hold the l2-norms of the centered x columns in each slice.
   """
   data = m.children[0].to_sql(table, split_by + m.group_by)
   with_data = data.with_data
@@ -63,71 +67,129 @@ def get_data(m, table, split_by, execute, normalize=False):
   y = data.columns[-m.k - 1].alias
   xs = data.columns.aliases[-m.k:]
   if not normalize:
-    return table, with_data, xs, y, pd.DataFrame(), pd.DataFrame()
+    return table, with_data, xs, y, [], []
 
+  # The averages and l2-norms needed to recover the coefficients are carried
+  # along as columns so the caller can fetch them in the same query that
+  # computes the sufficient stats, instead of executing separate queries.
   split_by = sql.Columns(split_by).aliases
-  avgs = [sql.Column(f'AVG({x})', alias=x) for x in xs]
-  avgs.append(sql.Column(f'AVG({y})', alias=y))
-  avgs = execute(
-      str(
-          sql.Sql(
-              sql.Columns(split_by).add(avgs),
-              table,
-              groupby=split_by,
-              with_data=with_data)))
   table_with_centered_x = sql.Columns(split_by + [sql.Column(y, alias=y)])
   for x in xs:
     centered = sql.Column(x) - sql.Column(x, 'AVG({})', partition=split_by)
     centered.alias = x
     table_with_centered_x.add(centered)
+  avgs = []
+  for i, x in enumerate(xs + [y]):
+    alias = f'avg_x{i}' if i < len(xs) else 'avg_y'
+    avg = sql.Column(x, 'AVG({})', alias, partition=split_by)
+    table_with_centered_x.add(avg)
+    avgs.append(avg.alias)
   table, rename = with_data.merge(
       sql.Datasource(sql.Sql(table_with_centered_x, table), 'DataCentered'))
 
-  norms = [
-      sql.Column('SQRT(SUM(POWER(%s, 2)))' % rename.get(x, x), alias=x)
-      for x in xs
-  ]
-  norms = sql.Sql(
-      sql.Columns(split_by).add(norms),
-      table,
-      groupby=split_by,
-      with_data=with_data)
-  norms = execute(str(norms))
   table_with_normalized_x = sql.Columns(split_by + [sql.Column(y, alias=y)])
   for x in xs:
     normalized = sql.Column(x) / sql.Column(
         x, 'SUM(POWER({}, 2))', partition=split_by)**0.5
     normalized.alias = x
     table_with_normalized_x.add(normalized)
+  avgs = [sql.Column(rename.get(a, a), alias=a) for a in avgs]
+  table_with_normalized_x.add(avgs)
+  avgs = [a.alias for a in avgs]
+  norms = []
+  for i, x in enumerate(xs):
+    norm = sql.Column(
+        rename.get(x, x), 'SUM(POWER({}, 2))', partition=split_by)**0.5
+    norm.alias = f'norm_x{i}'
+    table_with_normalized_x.add(norm)
+    norms.append(norm.alias)
   table = with_data.add(
       sql.Datasource(sql.Sql(table_with_normalized_x, table), 'DataNormalized'))
   return table, with_data, xs, y, avgs, norms
 
 
+class SufficientStats(object):
+  """Holds the sufficient stats elements of all slices in contiguous arrays.
+
+  The query in get_sufficient_stats_elements() returns one row per slice. The
+  numeric elements are stored in a single 2D float array so consumers can index
+  them by position instead of by label.
+
+  Attributes:
+    values: A 2D float numpy array. Each row corresponds to one slice and each
+      column to one element, like x0, x0x1, y, x0y or n_obs.
+    layout: A dict mapping the names of the elements to their column positions
+      in values.
+    index: A pd.Index or pd.MultiIndex of the slices, sorted. None if the data
+      isn't split.
+    split_by: The columns that we use to split the data.
+  """
+
+  def __init__(self, sufficient_stats_elements, split_by=None):
+    """Converts the DataFrame returned by the query.
+
+    Args:
+      sufficient_stats_elements: A DataFrame returned by the query in
+        get_sufficient_stats_elements(), with split_by being the leading
+        columns.
+      split_by: The columns that we use to split the data.
+    """
+    self.split_by = split_by or []
+    self.index = None
+    if self.split_by:
+      # Special characters in split_by got escaped during SQL execution.
+      sufficient_stats_elements.columns = self.split_by + list(
+          sufficient_stats_elements.columns)[len(self.split_by):]
+      sufficient_stats_elements = sufficient_stats_elements.dropna(
+          subset=self.split_by).set_index(self.split_by).sort_index()
+      self.index = sufficient_stats_elements.index
+    self.layout = {c: i for i, c in enumerate(sufficient_stats_elements)}
+    self.values = sufficient_stats_elements.to_numpy(np.float64)
+
+  def __getitem__(self, name):
+    return self.values[:, self.layout[name]]
+
+  def take(self, names):
+    """Gets the elements of names. It's a view if they are stored contiguously.
+
+    Args:
+      names: A list of the names of the elements.
+
+    Returns:
+      A 2D numpy array whose columns are the elements of names.
+    """
+    idx = [self.layout[n] for n in names]
+    if idx and idx == list(range(idx[0], idx[0] + len(idx))):
+      return self.values[:, idx[0]:idx[0] + len(idx)]
+    return self.values[:, idx]
+
+  def __len__(self):
+    return len(self.values)
+
+
 def apply_algorithm_to_sufficient_stats_elements(sufficient_stats_elements,
                                                  split_by, algorithm, *args,
                                                  **kwargs):
   """Applies algorithm to sufficient stats to get the coefficients of Models.
 
   Args:
-    sufficient_stats_elements: Contains the elements to construct sufficient
-      stats. It's one of the return of get_sufficient_stats_elements().
+    sufficient_stats_elements: A SufficientStats that contains the elements to
+      construct sufficient stats. It's one of the return of
+      get_sufficient_stats_elements().
     split_by: The columns that we use to split the data.
-    algorithm: A function that can take the sufficient_stats_elements of a slice
-      of data and computes the coefficients of the Model.
+    algorithm: A function that can take the sufficient_stats_elements of all
+      slices of data and computes the coefficients of the Model for all slices
+      at once.
     *args: Additional args passed to the algorithm.
     **kwargs: Additional kwargs passed to the algorithm.
 
   Returns:
-    The coefficients of the Model.
+    The coefficients of the Model. If split_by, it's indexed by split_by.
   """
-  fn = lambda row: algorithm(row, *args, **kwargs)
+  res = algorithm(sufficient_stats_elements, *args, **kwargs)
   if split_by:
-    # Special characters in split_by got escaped during SQL execution.
-    sufficient_stats_elements.columns = split_by + list(
-        sufficient_stats_elements.columns)[len(split_by):]
-    return sufficient_stats_elements.groupby(split_by).apply(fn)
-  return fn(sufficient_stats_elements)
+    res.index = sufficient_stats_elements.index
+  return res
 
 
 def get_sufficient_stats_elements(m,
@@ -151,17 +213,16 @@ def get_sufficient_stats_elements(m,
 
   Returns:
     xs: A list of the column names of x1, x2, ...
-    sufficient_stats_elements: A DataFrame holding all unique elements of
+    sufficient_stats_elements: A SufficientStats holding all unique elements of
       sufficient stats. Each row corresponds to one slice in split_by. The
-      columns are
-        split_by,
+      elements are
         avg(x0), avg(x1), ...,  # if fit_intercept
         avg(x0 * x0), avg(x0 * x1), avg(x0 * x2), avg(x1 * x2), ...,
         avg(y),  # if fit_intercept
         avg(x0 * y), avg(x1 * y), ...,
         n_observation  # if include_n_obs.
-      The column are named as
-        split_by, x0, x1,..., x0x0, x0x1,..., y, x0y, x1y,..., n_obs.
+      The elements are named as
+        x0, x1,..., x0x0, x0x1,..., y, x0y, x1y,..., n_obs.
     avg_x: Nonempty only when normalize. A pd.DataFrame which holds the
       avg(x0), avg(x1), ... of the UNNORMALIZED x.
       Don't confuse it with the ones in the sufficient_stats_elements, which are
@@ -172,57 +233,167 @@ def get_sufficient_stats_elements(m,
   fit_intercept = m.fit_intercept if fit_intercept is None else fit_intercept
   if normalize is None:
     normalize = m.normalize and m.fit_intercept
-  table, with_data, xs, y, avg_x, norms = get_data(m, table, split_by, execute,
-                                                   normalize)
+  if normalize:
+    return get_normalized_sufficient_stats_elements(m, table, split_by,
+                                                    execute, fit_intercept,
+                                                    include_n_obs)
+  query, xs, _ = get_sufficient_stats_query(m, table, split_by, fit_intercept,
+                                            include_n_obs)
+  sufficient_stats_elements = SufficientStats(execute(str(query)), split_by)
+  return xs, sufficient_stats_elements, pd.DataFrame(), pd.DataFrame()
+
+
+def get_sufficient_stats_query(m, table, split_by, fit_intercept,
+                               include_n_obs):
+  """Gets the query that computes the elements of X'X and X'y of the raw x.
+
+  Args:
+    m: A Model instance.
+    table: The table we want to query from.
+    split_by: The columns that we use to split the data.
+    fit_intercept: If to include intercept in the model.
+    include_n_obs: If to include the number of observations in the return.
+
+  Returns:
+    query: A sql.Sql that computes the elements described in
+      get_sufficient_stats_elements().
+    xs: A list of the column names of x1, x2, ...
+    y: The column name of the y column.
+  """
+  table, with_data, xs, y, _, _ = get_data(m, table, split_by)
   x_t_x = []
   x_t_y = []
-  if m.fit_intercept:
-    if not normalize:
-      x_t_x = [sql.Column(f'AVG({x})', alias=f'x{i}') for i, x in enumerate(xs)]
+  if fit_intercept:
+    x_t_x = [sql.Column(f'AVG({x})', alias=f'x{i}') for i, x in enumerate(xs)]
     x_t_y = [sql.Column(f'AVG({y})', alias='y')]
-  for i, x1 in enumerate(xs):
-    for j, x2 in enumerate(xs[i:]):
-      x_t_x.append(sql.Column(f'AVG({x1} * {x2})', alias=f'x{i}x{i + j}'))
+  # The pairs come in the same order as the upper triangular layout of X'X in
+  # get_sufficient_stats_layout(), so they can be read back as one block.
+  x_t_x += [
+      sql.Column(f'AVG({xs[i]} * {xs[j]})', alias=f'x{i}x{j}')
+      for i, j in itertools.combinations_with_replacement(range(len(xs)), 2)
+  ]
   x_t_y += [
       sql.Column(f'AVG({x} * {y})', alias=f'x{i}y') for i, x in enumerate(xs)
   ]
   cols = sql.Columns(x_t_x + x_t_y)
   if include_n_obs:
     cols.add(sql.Column('COUNT(*)', alias='n_obs'))
-  sufficient_stats_elements = sql.Sql(
+  query = sql.Sql(
       cols, table, groupby=sql.Columns(split_by).aliases, with_data=with_data)
-  sufficient_stats_elements = execute(str(sufficient_stats_elements))
-  if normalize:
-    col_names = list(sufficient_stats_elements.columns)
-    avg_x_names = [f'x{i}' for i in range(len(xs))]
-    sufficient_stats_elements[avg_x_names] = 0
-    sufficient_stats_elements = sufficient_stats_elements[
-        col_names[:len(split_by)] + avg_x_names + col_names[len(split_by):]]
+  return query, xs, y
+
+
+def get_normalized_sufficient_stats_elements(m, table, split_by, execute,
+                                             fit_intercept, include_n_obs):
+  """Computes the elements of X'X and X'y with x centered and normalized.
+
+  The elements are derived from the ones of the raw x, so we don't need to
+  center and normalize x in SQL. Let u_i be avg(x_i) and e_ij be avg(x_i * x_j).
+  The l2-norm of the centered x_i is sqrt(n_obs * (e_ii - u_i^2)) and
+  avg(x_i' * x_j') = (e_ij - u_i * u_j) / (norm_i * norm_j), where x_i' is the
+  normalized x_i. Similarly, avg(x_i' * y) = (avg(x_i * y) - u_i * avg(y)) /
+  norm_i. The averages of all x_i' are 0.
+
+  Args:
+    m: A Model instance.
+    table: The table we want to query from.
+    split_by: The columns that we use to split the data.
+    execute: A function that can executes a SQL query and returns a DataFrame.
+    fit_intercept: If to include intercept in the model.
+    include_n_obs: If to include the number of observations in the return.
+
+  Returns:
+    Same as get_sufficient_stats_elements() with normalize being True.
+  """
+  query, xs, y = get_sufficient_stats_query(m, table, split_by, True, True)
+  raw = SufficientStats(execute(str(query)), split_by)
+  n = len(xs)
+  x_t_x_cols, _, rows, cols = get_sufficient_stats_layout(n, False)
+  avg_x = raw.take([f'x{i}' for i in range(n)])
+  avg_y = raw['y']
+  n_obs = raw['n_obs']
+  x_squared = raw.take([f'x{i}x{i}' for i in range(n)])
+  norms = np.sqrt(n_obs[:, np.newaxis] * (x_squared - avg_x**2))
+  x_t_x = raw.take(x_t_x_cols) - avg_x[:, rows] * avg_x[:, cols]
+  x_t_x /= norms[:, rows] * norms[:, cols]
+  x_t_y = raw.take([f'x{i}y' for i in range(n)]) - avg_x * avg_y[:, np.newaxis]
+  x_t_y /= norms
+
+  elements = [np.zeros_like(avg_x), x_t_x]
+  names = [f'x{i}' for i in range(n)] + x_t_x_cols
+  if fit_intercept:
+    elements.append(avg_y[:, np.newaxis])
+    names.append('y')
+  elements.append(x_t_y)
+  names += [f'x{i}y' for i in range(n)]
+  if include_n_obs:
+    elements.append(n_obs[:, np.newaxis])
+    names.append('n_obs')
+  sufficient_stats_elements = pd.DataFrame(
+      np.hstack(elements), columns=names, index=raw.index)
+  # Match the column names the query would have returned.
+  names = [c.strip('`') for c in xs]
+  avg_x = pd.DataFrame(
+      np.column_stack((avg_x, avg_y)),
+      columns=names + [y.strip('`')],
+      index=raw.index)
+  norms = pd.DataFrame(norms, columns=names, index=raw.index)
+  if split_by:
+    sufficient_stats_elements.reset_index(inplace=True)
+    avg_x.reset_index(inplace=True)
+    norms.reset_index(inplace=True)
+  sufficient_stats_elements = SufficientStats(sufficient_stats_elements,
+                                              split_by)
   return xs, sufficient_stats_elements, avg_x, norms
 
 
 def construct_matrix_from_elements(sufficient_stats_elements, xs,
                                    fit_intercept):
-  """Constructs matries X'X and X'y from the elements.
+  """Constructs matries X'X and X'y of all slices from the elements.
 
   Args:
-    sufficient_stats_elements: A DataFrame holding all unique elements of
+    sufficient_stats_elements: A SufficientStats holding all unique elements of
       sufficient stats. See the doc of get_sufficient_stats_elements() for its
-      shape and content.
+      content.
     xs: A list of the column names of x1, x2, ...
     fit_intercept: If the model includes an intercept.
 
   Returns:
-    x_t_x: X'X / n_observations in a numpy array.
-    x_t_y: X'y / n_observations in a numpy array.
+    x_t_x: X'X / n_observations in a numpy array. Its shape is (n_slices, k, k)
+      where k is the number of coefficients.
+    x_t_y: X'y / n_observations in a numpy array in the shape of (n_slices, k).
+  """
+  if not isinstance(sufficient_stats_elements, SufficientStats):
+    raise ValueError('The input must be a SufficientStats!')
+  x_t_x_cols, x_t_y_cols, rows, cols = get_sufficient_stats_layout(
+      len(xs), fit_intercept)
+  x_t_x_elements = sufficient_stats_elements.take(x_t_x_cols)
+  x_t_y = sufficient_stats_elements.take(x_t_y_cols)
+  k = x_t_y.shape[1]
+  x_t_x = np.empty((len(sufficient_stats_elements), k, k))
+  if fit_intercept:
+    x_t_x[:, 0, 0] = 1
+  x_t_x[:, rows, cols] = x_t_x_elements
+  x_t_x[:, cols, rows] = x_t_x_elements
+  return x_t_x, x_t_y
+
+
+@functools.lru_cache(maxsize=None)
+def get_sufficient_stats_layout(n, fit_intercept):
+  """Gets how the elements of X'X and X'y are laid out.
+
+  Args:
+    n: The number of features, excluding the intercept.
+    fit_intercept: If the model includes an intercept.
+
+  Returns:
+    x_t_x_cols: The names of the elements of X'X, excluding the constant 1 in
+      the top-left corner when fit_intercept is True.
+    x_t_y_cols: The names of the elements of X'y.
+    rows: The row indices in X'X of the elements named by x_t_x_cols.
+    cols: The column indices in X'X of the elements named by x_t_x_cols. Rows
+      and cols together index the upper triangular part of X'X.
   """
-  if isinstance(sufficient_stats_elements, pd.DataFrame):
-    if len(sufficient_stats_elements) > 1:
-      raise ValueError('Only support 1D input!')
-    sufficient_stats_elements = sufficient_stats_elements.iloc[0]
-  elif not isinstance(sufficient_stats_elements, pd.Series):
-    raise ValueError('The input must be a panda Series!')
-  n = len(xs)
   x_t_x_cols = []
   x_t_y_cols = []
   if fit_intercept:
@@ -232,31 +403,76 @@ def construct_matrix_from_elements(sufficient_stats_elements, xs,
     for j in range(i, n):
       x_t_x_cols.append(f'x{i}x{j}')
   x_t_y_cols += [f'x{i}y' for i in range(n)]
-  x_t_x_elements = list(sufficient_stats_elements[x_t_x_cols])
+  rows, cols = get_triu_indices(n + fit_intercept)
   if fit_intercept:
-    x_t_x_elements = [1] + x_t_x_elements
-  x_t_y = sufficient_stats_elements[x_t_y_cols]
-  x_t_x = symmetrize_triangular(x_t_x_elements)
-  return x_t_x, x_t_y
+    rows, cols = rows[1:], cols[1:]
+  return x_t_x_cols, x_t_y_cols, rows, cols
 
 
-def symmetrize_triangular(tril_elements):
+def symmetrize_triangular(tril_elements, out=None):
   """Converts a list of upper triangular matrix to a symmetric matrix.
 
-  For example, [1, 2, 3] -> [[1, 2], [2, 3]].
+  For example, [1, 2, 3] -> [[1, 2], [2, 3]]. The elements of many matrices can
+  be stacked along the leading axes, then all of them are converted at once.
 
   Args:
-    tril_elements: A list that can form a triangular matrix.
+    tril_elements: A list or an array that can form a triangular matrix along
+      its last axis.
+    out: An optional array to write the result into. It must have the shape of
+      the result.
 
   Returns:
     A symmetric matrix whose upper triangular part is formed from tril_elements.
+    If tril_elements has more than one axis, the leading axes are kept.
   """
-  n = int(np.floor((2 * len(tril_elements))**0.5))
-  if n * (n + 1) / 2 != len(tril_elements):
+  tril_elements = np.asarray(tril_elements)
+  m = tril_elements.shape[-1]
+  n = int(round(((8 * m + 1)**0.5 - 1) / 2))
+  if n * (n + 1) // 2 != m:
     raise ValueError('The elements cannot form a symmetric matrix!')
-  sym = np.zeros([n, n])
-  sym[np.triu_indices(n)] = tril_elements
-  return sym + sym.T - np.diag(sym.diagonal())
+  rows, cols = get_triu_indices(n)
+  sym = np.empty(tril_elements.shape[:-1] + (n, n)) if out is None else out
+  sym[..., rows, cols] = tril_elements
+  sym[..., cols, rows] = tril_elements
+  return sym
+
+
+@functools.lru_cache(maxsize=None)
+def get_coef_names(xs, fit_intercept):
+  """Gets the names of the coefficients.
+
+  Args:
+    xs: A tuple of the SQL aliases of the x columns.
+    fit_intercept: If the model includes an intercept, which comes first.
+
+  Returns:
+    A tuple of the names of the coefficients, with the SQL escaping undone.
+  """
+  names = tuple(n.replace('macro_', '$').strip('`') for n in xs)
+  return ('intercept',) + names if fit_intercept else names
+
+
+@functools.lru_cache(maxsize=None)
+def get_multi_class_coef_names(names, classes):
+  """Gets the names of the coefficients of a multi-class model.
+
+  Args:
+    names: A tuple of the names of the coefficients of one class.
+    classes: A tuple of the classes of the model.
+
+  Returns:
+    A tuple of the names of all the coefficients, ordered by class first.
+  """
+  return tuple(f'{n} for class {c}' for c in classes for n in names)
+
+
+@functools.lru_cache(maxsize=None)
+def get_triu_indices(n):
+  """Cached np.triu_indices(n). The returned arrays are read-only."""
+  rows, cols = np.triu_indices(n)
+  rows.flags.writeable = False
+  cols.flags.writeable = False
+  return rows, cols
 
 
 class Model(operations.Operation):
@@ -295,8 +511,9 @@ class Model(operations.Operation):
     """
     if not isinstance(y, metrics.Metric):
       raise ValueError('y must be a Metric!')
-    if count_features(y) != 1:
-      raise ValueError('y must be a 1D array but is %iD!' % count_features(y))
+    n_y = count_features(y)
+    if n_y != 1:
+      raise ValueError('y must be a 1D array but is %iD!' % n_y)
     self.group_by = [group_by] if isinstance(group_by, str) else group_by or []
     if isinstance(x, Sequence):
       x = metrics.MetricList(x)
@@ -320,22 +537,24 @@ class Model(operations.Operation):
     self.normalize = normalize
 
   def compute(self, df):
-    x, y = df.iloc[:, 1:], df.iloc[:, 0]
+    x = df.iloc[:, 1:].to_numpy(np.float64)
+    y = df.iloc[:, 0].to_numpy(np.float64)
     if self.normalize and self.fit_intercept:
-      x_scaled = x - x.mean()
-      norms = np.sqrt((x_scaled**2).sum())
-      x = x_scaled / norms
+      x_mean = x.mean(axis=0)
+      x = x - x_mean
+      norms = np.sqrt(np.einsum('ij,ij->j', x, x))
+      x /= norms
     self.model.fit(x, y)
     coef = self.model.coef_
     if self.normalize and self.fit_intercept:
-      coef = coef / norms.values
+      coef = coef / norms
     names = list(df.columns[1:])
     if self.fit_intercept:
       if self.normalize:
-        intercept = y.mean() - df.iloc[:, 1:].mean().dot(coef)
+        intercept = y.mean() - x_mean.dot(coef)
       else:
         intercept = self.model.intercept_
-      coef = [intercept] + list(coef)
+      coef = np.concatenate([[intercept], coef])
       names = ['intercept'] + names
     return pd.DataFrame([coef], columns=names)
 
@@ -436,8 +655,6 @@ class Ridge(Model):
 
 def compute_ridge_coefs(sufficient_stats, xs, m):
   """Computes coefficients of linear/ridge regression from sufficient_stats."""
-  if isinstance(sufficient_stats, pd.DataFrame):
-    sufficient_stats = sufficient_stats.iloc[0]
   fit_intercept = m.fit_intercept
   if fit_intercept and m.normalize:
     return compute_coef_for_normalize_ridge(sufficient_stats, xs, m)
@@ -445,21 +662,14 @@ def compute_ridge_coefs(sufficient_stats, xs, m):
                                                 fit_intercept)
   if isinstance(m, Ridge):
     n_obs = sufficient_stats['n_obs']
-    penalty = np.identity(len(x_t_y))
+    penalty = np.identity(x_t_y.shape[1])
     if fit_intercept:
       penalty[0, 0] = 0
     # We use AVG() to compute x_t_x so the penalty needs to be scaled.
-    x_t_x += m.alpha / n_obs * penalty
-  cond = np.linalg.cond(x_t_x)
-  if cond > 20:
-    print(
-        "WARNING: The condition number of X'X is %i, which might be too large."
-        ' The model coefficients might be inaccurate.' % cond)
-  coef = np.linalg.solve(x_t_x, x_t_y)
-  xs = [n.replace('macro_', '$').strip('`') for n in xs]
-  if fit_intercept:
-    xs = ['intercept'] + xs
-  return pd.DataFrame([coef], columns=xs)
+    x_t_x += (m.alpha / n_obs)[:, np.newaxis, np.newaxis] * penalty
+  coef = solve_normal_equations(x_t_x, x_t_y)
+  xs = get_coef_names(tuple(xs), fit_intercept)
+  return pd.DataFrame(coef, index=sufficient_stats.index, columns=xs)
 
 
 def compute_coef_for_normalize_ridge(sufficient_stats, xs, m):
@@ -467,30 +677,68 @@ def compute_coef_for_normalize_ridge(sufficient_stats, xs, m):
   n = len(xs)
   # Compute the elements of X_scaled^T * X_scaled. See
   # https://colab.research.google.com/drive/1wOWgdNzKGT_xl4A7Mrs_GbRKiVQACFfy#scrollTo=HrMCbB5SxS0A
-  x_t_x_elements = []
-  x_t_y = []
-  for i in range(n):
-    x_t_y.append(sufficient_stats[f'x{i}y'] -
-                 sufficient_stats[f'x{i}'] * sufficient_stats['y'])
-    for j in range(i, n):
-      x_t_x_elements.append(sufficient_stats[f'x{i}x{j}'] -
-                            sufficient_stats[f'x{i}'] *
-                            sufficient_stats[f'x{j}'])
+  x_t_x_cols, _, rows, cols = get_sufficient_stats_layout(n, False)
+  avg_x = sufficient_stats.take([f'x{i}' for i in range(n)])
+  avg_y = sufficient_stats['y']
+  x_t_y = sufficient_stats.take([f'x{i}y' for i in range(n)])
+  x_t_y = x_t_y - avg_x * avg_y[:, np.newaxis]
+  x_t_x_elements = sufficient_stats.take(x_t_x_cols)
+  x_t_x_elements = x_t_x_elements - avg_x[:, rows] * avg_x[:, cols]
   x_t_x = symmetrize_triangular(x_t_x_elements)
   if isinstance(m, Ridge):
-    x_t_x += m.alpha * np.diag(x_t_x.diagonal())
-  cond = np.linalg.cond(x_t_x)
-  if cond > 20:
+    diag = np.arange(n)
+    x_t_x[:, diag, diag] *= 1 + m.alpha
+  # Solve into a preallocated buffer so the intercept doesn't need another copy.
+  coef = np.empty((len(sufficient_stats), n + 1))
+  coef[:, 1:] = solve_normal_equations(x_t_x, x_t_y)
+  coef[:, 0] = avg_y - np.einsum('ij,ij->i', coef[:, 1:], avg_x)
+  xs = get_coef_names(tuple(xs), True)
+  return pd.DataFrame(coef, index=sufficient_stats.index, columns=xs)
+
+
+def solve_normal_equations(x_t_x, x_t_y):
+  """Solves x_t_x * coef = x_t_y for all slices in one batch.
+
+  Args:
+    x_t_x: A numpy array in the shape of (n_slices, k, k).
+    x_t_y: A numpy array in the shape of (n_slices, k).
+
+  Returns:
+    The coefficients in a numpy array in the shape of (n_slices, k).
+  """
+  # X'X is symmetric so its condition number is the ratio of the largest and
+  # smallest absolute eigenvalues, which is cheaper to get than the SVD used by
+  # np.linalg.cond().
+  eigvals = abs(np.linalg.eigvalsh(x_t_x))
+  with np.errstate(divide='ignore'):
+    conds = eigvals.max(axis=-1) / eigvals.min(axis=-1)
+  for cond in conds[conds > 20]:
+    # A singular X'X has a zero eigenvalue so its condition number is inf.
+    cond = '%i' % cond if np.isfinite(cond) else 'inf'
     print(
-        "WARNING: The condition number of X'X is %i, which might be too large."
+        "WARNING: The condition number of X'X is %s, which might be too large."
         ' The model coefficients might be inaccurate.' % cond)
-  coef = np.linalg.solve(x_t_x, x_t_y)
-  xs = [n.replace('macro_', '$').strip('`') for n in xs]
-  intercept = sufficient_stats.y - coef.dot(
-      [sufficient_stats[f'x{i}'] for i in range(n)])
-  coef = [intercept] + list(coef)
-  xs = ['intercept'] + xs
-  return pd.DataFrame([coef], columns=xs)
+  return solve_psd(x_t_x, x_t_y)
+
+
+def solve_psd(a, b):
+  """Solves a * x = b in batch where a are positive semi-definite matrices.
+
+  Args:
+    a: A numpy array in the shape of (n, k, k).
+    b: A numpy array in the shape of (n, k).
+
+  Returns:
+    x in a numpy array in the shape of (n, k).
+  """
+  if len(a) == 1:
+    # A Cholesky solve is cheaper than LU for a single, possibly large, matrix.
+    # It fails if the matrix is singular, then we fall back to LU.
+    _, x, info = linalg.lapack.dposv(a[0], b[0])
+    if not info:
+      return x[np.newaxis]
+  # There is no batched Cholesky solve so LU solves all the systems in one call.
+  return np.linalg.solve(a, b[..., np.newaxis])[..., 0]
 
 
 class Lasso(Model):
@@ -572,7 +820,14 @@ class ElasticNet(Model):
 
 
 class LogisticRegression(Model):
-  """A class that can fit a logistic regression."""
+  """A class that can fit a logistic regression.
+
+  In the magic mode of compute_on_sql(), the L1 penalty, including the L1 part
+  of elasticnet, is smoothed near 0 so Newton's method can optimize it. Within
+  tol of 0, |coef| is replaced by the Huber function coef^2 / (2 * tol) +
+  tol / 2. As a result, coefficients that sklearn would set to exactly 0 only
+  end up within about tol of 0.
+  """
 
   def __init__(self,
                y: metrics.Metric,
@@ -595,8 +850,19 @@ class LogisticRegression(Model):
                verbose=0,
                warm_start=False,
                n_jobs=None,
-               l1_ratio=None):
-    """Initialize a sklearn.LogisticRegression model."""
+               l1_ratio=None,
+               fixed_hessian=False):
+    """Initialize a sklearn.LogisticRegression model.
+
+    All the args except fixed_hessian are passed to sklearn. fixed_hessian only
+    affects the magic mode of compute_on_sql(). If True, we use the fixed bound
+    X'X / 4 of the Hessian in the Newton iterations, so each iteration only
+    needs to compute the gradients. It usually takes more iterations to
+    converge but each iteration is much cheaper when there are many features.
+    warm_start is also respected by the magic mode. The Newton iterations of a
+    slice start from the coefficients of the same slice in the last call, if
+    that call was on the same table, with the same where and features.
+    """
     model = linear_model.LogisticRegression(
         fit_intercept=fit_intercept,
         penalty=penalty,
@@ -622,6 +888,8 @@ class LogisticRegression(Model):
     self.intercept_scaling = intercept_scaling or 1
     self.max_iter = max_iter
     self.l1_ratio = l1_ratio
+    self.fixed_hessian = fixed_hessian
+    self._warm_start_coefs = None
 
   def compute(self, df):
     self.model.fit(df.iloc[:, 1:], df.iloc[:, 0])
@@ -630,9 +898,7 @@ class LogisticRegression(Model):
     if coef.shape[0] == 1:
       coef = coef[0]
       if self.fit_intercept:
-        intercept = self.model.intercept_
-        intercept = intercept[0]
-        coef = [intercept] + list(coef)
+        coef = np.concatenate((self.model.intercept_[:1], coef))
         names = ['intercept'] + names
       return pd.DataFrame([coef], columns=names)
     else:
@@ -640,11 +906,9 @@ class LogisticRegression(Model):
       if self.fit_intercept:
         coef = np.hstack((self.model.intercept_.reshape(-1, 1), coef))
         names = ['intercept'] + names
-      res = pd.DataFrame(
-          coef.reshape(1, -1),
-          columns=(f'{n} for class {c}'
-                   for c, n in itertools.product(self.model.classes_, names)))
-      return res
+      names = get_multi_class_coef_names(
+          tuple(names), tuple(self.model.classes_))
+      return pd.DataFrame(coef.reshape(1, -1), columns=names)
 
   def compute_on_sql_magic_mode(self, table, split_by, execute):
     """Gets the coefficients by minimizing the cost function.
@@ -675,6 +939,8 @@ class LogisticRegression(Model):
       print("WARNING: Our solution for L1 and elasticnet penalty doesn't quite "
             'achieve sparsity. Please interprete the results with care.')
 
+    # Warm starts only reuse the coefficients fitted on the same data.
+    warm_start_key = str(table)
     y = self.y.compute_on_sql(table, self.group_by, execute)
     n_y = y.iloc[:, 0].nunique()
     if n_y != 2:
@@ -682,199 +948,364 @@ class LogisticRegression(Model):
           f'Magic mode only support two classes but got {n_y} distinct y values!'
       )
 
-    table, with_data, xs, y, _, _ = get_data(self, table, split_by, execute)
+    table, with_data, xs, y, _, _ = get_data(self, table, split_by)
     if self.fit_intercept:
       xs.append('1')
+    k = len(xs)
     conds = []
     if split_by:
+      # Each slice gets an integer id so the coefficients of all slices can be
+      # joined to the data by id. This way the slice values never need to be
+      # embedded in the query as literals.
+      split_cols = sql.Columns(split_by).aliases
+      distinct_slices = sql.Sql(
+          sql.Columns(split_cols, True), table,
+          [f'{c} IS NOT NULL' for c in split_cols])
+      slice_ids = sql.Sql(
+          sql.Columns(split_cols).add(
+              sql.Column('ROW_NUMBER()', alias='_slice_id', order=split_cols)),
+          distinct_slices)
+      slice_ids = with_data.add(sql.Datasource(slice_ids, 'SliceIds'))
       slices = execute(
-          str(sql.Sql(sql.Columns(split_by, True), table, with_data=with_data)))
-      conds = slices.values
-    self._gradients = None
-
-    def grads(*unused_args):
-      return self._gradients
-
-    def hess(coef, converged):
-      return compute_grads_and_hess(coef, converged)
+          str(
+              sql.Sql(
+                  sql.Columns(split_cols + ['_slice_id']),
+                  slice_ids,
+                  with_data=with_data)))
+      slices = slices.sort_values('_slice_id')
+      conds = slices.iloc[:, :len(split_by)].values
+      data = sql.Join(table, slice_ids, using=split_cols)
+    query_templates = {}
 
     def compute_grads_and_hess(coef, converged):
-      """Computes the gradients and Hessian matrices for coef.
+      """Computes the gradients and Hessian matrices for coef in one query.
 
-      The grads we computes here is a n*k list of gradients, where n is the
-      number of slices and k is the number of features. It has the same shape
-      with coef, and represents the gradients of the coefficients. The
-      gradients are saved to self._gradients as a side effect.
-      Similarly, the Hessian matrices we return is a n*k*k array. Each k*k
+      The grads we computes here is a m*k array of gradients, where m is the
+      number of slices that haven't converged and k is the number of features.
+      It represents the gradients of the coefficients of those slices.
+      Similarly, the Hessian matrices we return is a m*k*k array. Each k*k
       element is a Hessian matrix.
 
       Args:
         coef: A n*k array of coefficients being optimized. n is the number of
           slices and k is the number of features.
-        converged: A list of the length of the number of slices. Its values
-          indicate whether the coefficients of the slice have converged. If
-          converged, we skip the computation for that slice.
+        converged: A boolean array of the length of the number of slices. Its
+          values indicate whether the coefficients of the slice have converged.
+          If converged, we skip the computation for that slice.
+
+      Returns:
+        grads: A m*k array of the gradients of the slices that haven't
+          converged.
+        hess: A m*k*k array of the Hessian matrices of the slices that haven't
+          converged.
+      """
+      active = np.flatnonzero(~converged)
+      if not (converged.any() or coef.any()):
+        query = get_initial_grads_and_hess_query()
+      else:
+        key = tuple(active)
+        if key not in query_templates:
+          # Converged slices never become active again so the old templates
+          # won't be used anymore.
+          query_templates.clear()
+          query_templates[key] = get_grads_and_hess_template(active)
+        literals, slots = query_templates[key]
+        values = [f'{v}' for v in coef[active].ravel()[slots].tolist()]
+        query = literals[0] + ''.join(
+            v + l for v, l in zip(values, literals[1:]))
+      res = execute(query)
+      if split_by:
+        res = res.sort_values('_slice_id')
+      vals = res[value_cols].to_numpy(np.float64)
+      j = vals[:, :k]
+      if fixed_hess is None:
+        h = symmetrize_triangular(vals[:, k:-1], hess_buf[:len(active)])
+      else:
+        h = np.take(fixed_hess, active, 0, hess_buf[:len(active)])
+      add_penalty(coef[active], j, h, vals[:, -1])
+      return j, h
+
+    def get_grads_and_hess_template(active):
+      """Gets the SQL template to compute the gradients and Hessian matrixes.
+
+      The coefficients of the active slices are provided in a subquery, which
+      is joined to the data by slice id. It's the only part of the query that
+      changes across iterations, so we build the query once with placeholders
+      for the coefficients and only fill in the values in each iteration.
+
+      Args:
+        active: The indices of the slices that haven't converged.
 
       Returns:
-        A n*k*k Hessian matrices. We also save the gradients to self._gradients
-        as a side effect.
+        literals: The SQL query split by the coefficient placeholders.
+        slots: The positions of the placeholders in the flattened coefficients
+          of the active slices. The coefficients are interleaved with literals
+          when rendering the query.
       """
-      k = len(coef[0])
-      if not split_by:
-        grads, hessian = get_grads_and_hess_query(coef[0])
+      slice_coefs = []
+      for n, i in enumerate(active):
+        slice_coef = [f'\x00{n * k + m}\x00 AS _coef{m}' for m in range(k)]
+        if split_by:
+          slice_coef = [f'{i + 1} AS _slice_id'] + slice_coef
+        slice_coefs.append('SELECT ' + ', '.join(slice_coef))
+      slice_coefs = sql.Datasource('\nUNION ALL\n'.join(slice_coefs),
+                                   'SliceCoefs')
+      if split_by:
+        data_with_coefs = data.join(slice_coefs, using='_slice_id')
+        keys = ['_slice_id']
       else:
-        grads = []
-        hessian = []
-        split_cols = sql.Columns(split_by).aliases
-        for cond, slice_coef, done in zip(conds, coef, converged):
-          if not done:
-            condition = [
-                f'{c} = "{v}"' if isinstance(v, str) else f'{c} = {v}'
-                for c, v in zip(split_cols, cond)
-            ]
-            condition = ' AND '.join(condition)
-            j, h = get_grads_and_hess_query(slice_coef, condition)
-            grads += j
-            hessian += h
-      for i, c in enumerate(grads):
-        c.set_alias(f'grads_{i}')
-      for i, c in enumerate(hessian):
-        c.set_alias(f'hess_{i}')
-      grads_and_hess = sql.Sql(sql.Columns(grads + hessian), table)
-      grads_and_hess.with_data = with_data
-      grads_and_hess = execute(str(grads_and_hess)).iloc[0]
-      self._gradients = []
-      for done in converged:
-        if done:
-          self._gradients.append(None)
-        else:
-          self._gradients.append(grads_and_hess.values[:k])
-          grads_and_hess = grads_and_hess[k:]
-      hess_elements = list(grads_and_hess.values.reshape(-1, k * (k + 1) // 2))
-      hess_arr = []
-      for done in converged:
-        if done:
-          hess_arr.append(None)
-        else:
-          hess_arr.append(symmetrize_triangular(hess_elements.pop(0)))
-      return hess_arr
-
-    def get_grads_and_hess_query(coef, condition=None):
+        data_with_coefs = sql.Join(table, slice_coefs, join='CROSS')
+        keys = []
+      # The per-row terms shared by all the gradients and Hessian elements are
+      # computed once in CTEs, so the exponentials are only evaluated once per
+      # row and the query grows linearly with the number of features.
+      # A numerically stable implemntation, adapted from
+      # http://fa.bianp.net/blog/2019/evaluate_logistic. EXP(-ABS(z)) is EXP(z)
+      # when z < 0 and EXP(-z) otherwise.
+      irls_data = copy.deepcopy(with_data)
+      features = [x for x in xs if x != '1']
+      z = ' + '.join(f'_coef{i} * {xs[i]}' for i in range(k))
+      linear_predictor = sql.Columns(keys + features + [y]).add([
+          sql.Column(z, alias='_z'),
+          sql.Column(f'EXP(-ABS({z}))', alias='_exp_z')
+      ])
+      linear_predictor = irls_data.add(
+          sql.Datasource(
+              sql.Sql(linear_predictor, data_with_coefs), 'LinearPredictor'))
+      sig_z = 'IF(_z < 0, _exp_z / (1 + _exp_z), 1 / (1 + _exp_z))'
+      weights = sql.Columns(keys + features).add([
+          sql.Column(sig_minus_b('_z', y, '_exp_z', '_exp_z'), alias='_resid'),
+          sql.Column(
+              f'-{sig_z} * {sig_minus_b("_z", 1, "_exp_z", "_exp_z")}',
+              alias='_weight')
+      ])
+      weights = irls_data.add(
+          sql.Datasource(sql.Sql(weights, linear_predictor), 'IrlsWeights'))
+      grads_and_hess = sql.Sql(
+          grads_and_hess_cols, weights, groupby=keys, with_data=irls_data)
+      parts = str(grads_and_hess).split('\x00')
+      return parts[::2], np.array(parts[1::2], dtype=int)
+
+    def get_initial_grads_and_hess_query():
+      """Gets the SQL to compute the gradients and Hessian matrixes at coef = 0.
+
+      Newton's method starts from all-zero coefficients unless warm started.
+      Then z is 0 for every row so sigmoid(z) - y is 0.5 - y and the weights
+      are all 0.25. Neither the coefficients nor any exponential needs to be in
+      the query.
+
+      Returns:
+        The SQL query that computes grads_and_hess_cols for all slices.
+      """
+      keys = ['_slice_id'] if split_by else []
+      irls_data = copy.deepcopy(with_data)
+      features = [x for x in xs if x != '1']
+      weights = sql.Columns(keys + features).add([
+          sql.Column(f'0.5 - {y}', alias='_resid'),
+          sql.Column('0.25', alias='_weight')
+      ])
+      weights = irls_data.add(
+          sql.Datasource(
+              sql.Sql(weights, data if split_by else table), 'IrlsWeights'))
+      return str(
+          sql.Sql(
+              grads_and_hess_cols, weights, groupby=keys, with_data=irls_data))
+
+    def get_grads_and_hess_query():
       """Get the SQL columns to compute the gradients and Hessian matrixes.
 
       The formula of gradients and Hessian matrixes can be found in
       https://colab.research.google.com/drive/1Srfs4weM4LO9vt1HbOkGrD4kVbG8cso8.
       As the Hessian matrix is symmetric, we only construct the columns for
-      unique values.
-
-      Args:
-        coef: A n*k list of coefficients being optimized, where n is the number
-          of slices and k is the number of features.
-        condition: A condition that can be applied in the WHERE clause. The
-          gradients and Hessian matrixes will be computed on the rows that
-          satisfies the condition.
+      unique values. The columns aggregate the per-row terms _resid, which is
+      sigmoid(z) - y, and _weight, which is sigmoid(z) * (1 - sigmoid(z)),
+      computed in get_grads_and_hess_template(). The penalty terms are added by
+      add_penalty().
 
       Returns:
-        grads: A list of SQL columns which has the same shape with coef. It
-          represents the gradients of the corresponding coefficients.
-        hess: A list of SQL columns that can be used to construct the Hessian
-          matrix. Its elements are the upper triangular part of the Hessian,
-          from left to right, top to down.
+        A sql.Columns. Its first k columns are the gradients of the
+        coefficients. Then the columns that can be used to construct the
+        Hessian matrix follow. They are the upper triangular part of the
+        Hessian, from left to right, top to down. The last column is the number
+        of rows in the slice.
       """
-      # A numerically stable implemntation, adapted from
-      # http://fa.bianp.net/blog/2019/evaluate_logistic.
-      z = ' + '.join(f'{coef[i]} * {xs[i]}' for i in range(len(xs)))
       grads = [
-          sql.Column(
-              f'{x} * {sig_minus_b(z, y)}', 'AVG({})', filters=condition)
-          for x in xs
+          sql.Column(f'{x} * _resid', 'AVG({})', f'grads_{i}')
+          for i, x in enumerate(xs)
       ]
-      sig_z = """IF({z} < 0,
-          EXP({z}) / (1 + EXP({z})),
-          1 / (1 + EXP(-({z}))))""".format(z=z)
-      w = f'-{sig_z} * {sig_minus_b(z, 1)}'
       hess = []
-      for i, x1 in enumerate(xs):
-        for x2 in xs[i:]:
-          hess.append(
-              sql.Column(f'{x1} * {x2} * {w}', 'AVG({})', filters=condition))
-      hess = np.array(hess)
-      # See here for the behavior of differnt penalties.
-      # https://colab.research.google.com/drive/1Srfs4weM4LO9vt1HbOkGrD4kVbG8cso8
-      n = f'COUNTIF({condition})' if condition else 'COUNT(*)'
+      if not self.fixed_hessian:
+        pairs = itertools.combinations_with_replacement(xs, 2)
+        hess = [
+            sql.Column(f'{x1} * {x2} * _weight', 'AVG({})', f'hess_{n}')
+            for n, (x1, x2) in enumerate(pairs)
+        ]
+      return sql.Columns(grads + hess).add(sql.Column('COUNT(*)', alias='n'))
+
+    def get_fixed_hessian():
+      """Gets X'X / (4 * n) of all slices, which bounds all the Hessians.
+
+      As sigmoid(z) * (1 - sigmoid(z)) <= 1/4, X'X / (4 * n) is no smaller than
+      the Hessian matrix of the loss at any coef. Using it in place of the
+      Hessian still converges, see Böhning and Lindsay (1988), and as it
+      doesn't depend on coef we only need to compute it once.
+
+      Returns:
+        A n*k*k array of the fixed Hessian matrices of all slices.
+      """
+      pairs = itertools.combinations_with_replacement(range(k), 2)
+      cols = sql.Columns([
+          sql.Column(f'{xs[i]} * {xs[j]}', 'AVG({})', f'hess_{n}')
+          for n, (i, j) in enumerate(pairs)
+      ])
+      if split_by:
+        query = sql.Sql(cols, data, groupby='_slice_id', with_data=with_data)
+      else:
+        query = sql.Sql(cols, table, with_data=with_data)
+      res = execute(str(query))
+      if split_by:
+        res = res.sort_values('_slice_id')
+      return symmetrize_triangular(res[cols.aliases].to_numpy(np.float64) / 4)
+
+    # The diagonal positions of the Hessian that get the L2 penalty, which are
+    # the ones of the features other than the intercept.
+    penalized_diag = np.arange(self.k)
+
+    def add_penalty(coef, j, h, n):
+      """Adds the penalty terms to the gradients j and Hessian matrices h.
+
+      See here for the behavior of differnt penalties.
+      https://colab.research.google.com/drive/1Srfs4weM4LO9vt1HbOkGrD4kVbG8cso8
+
+      Args:
+        coef: A n*k array of the coefficients of the active slices.
+        j: A n*k array of the gradients of the active slices. Modified in place.
+        h: A n*k*k array of the Hessian matrices of the active slices. Modified
+          in place.
+        n: The numbers of rows in the active slices.
+      """
+      coef = coef[:, :self.k]
+      n = n[:, np.newaxis]
+      diag = penalized_diag
+      if self.penalty in ('l1', 'elasticnet'):
+        # |coef| is smoothed by the Huber function within self.tol of 0 so it
+        # has a second derivative there. Otherwise the subgradient flips sign
+        # around 0 and Newton's method oscillates.
+        eps = self.tol
+        small = abs(coef) < eps
+        l1_grads = np.where(small, coef / eps, np.sign(coef))
+        l1_hess = small / eps
       if self.penalty == 'l1':
-        for i in range(self.k):
-          grads[i] += sql.Column(f'SIGN({coef[i]}) / {n}') / self.c
+        j[:, :self.k] += l1_grads / n / self.c
+        h[:, diag, diag] += l1_hess / (n * self.c)
       elif self.penalty == 'l2':
-        for i in range(self.k):
-          grads[i] += sql.Column(f'{coef[i]} / {n}') / self.c
-        hess_diag_idx = np.arange(len(xs), len(xs) - self.k + 1, -1).cumsum()
-        hess_diag_idx = np.concatenate([[0], hess_diag_idx])
-        hess[hess_diag_idx] += sql.Column(f'1 / ({n} * {self.c})')
+        j[:, :self.k] += coef / n / self.c
+        h[:, diag, diag] += 1 / (n * self.c)
       elif self.penalty == 'elasticnet':
         l1 = self.l1_ratio / self.c
         l2 = (1 - self.l1_ratio) / self.c
-        for i in range(self.k):
-          grads[i] += sql.Column(
-              f'({l1} * SIGN({coef[i]}) + {l2} * {coef[i]}) / {n}')
-        hess_diag_idx = np.arange(len(xs), len(xs) - self.k + 1, -1).cumsum()
-        hess_diag_idx = np.concatenate([[0], hess_diag_idx])
-        hess[hess_diag_idx] += sql.Column(f'{l2} / {n}')
+        j[:, :self.k] += (l1 * l1_grads + l2 * coef) / n
+        h[:, diag, diag] += (l1 * l1_hess + l2) / n
       elif self.penalty != 'none':
         raise ValueError(
             f'LogisticRegression supports only penalties in '
             "['l1', 'l2', 'elasticnet', 'none'], got {self.penalty}.")
-      return grads, list(hess)
 
-    res = newtons_method(
-        np.zeros((len(conds) or 1, len(xs))), grads, hess, self.tol,
-        self.max_iter, conds)
-    xs = [n.replace('macro_', '$').strip('`') for n in xs]
+    grads_and_hess_cols = get_grads_and_hess_query()
+    value_cols = grads_and_hess_cols.aliases
+    fixed_hess = get_fixed_hessian() if self.fixed_hessian else None
+    coef = np.zeros((len(conds) or 1, k))
+    # Reused by all the iterations. The active slices take the leading part.
+    hess_buf = np.empty((len(coef), k, k))
+    slice_keys = [tuple(c) for c in conds] if split_by else [()]
+    warm_start_key = (warm_start_key, tuple(xs))
+    if self.model.warm_start and self._warm_start_coefs:
+      last_key, last_coefs = self._warm_start_coefs
+      if last_key == warm_start_key:
+        for i, s in enumerate(slice_keys):
+          if s in last_coefs:
+            coef[i] = last_coefs[s]
+    res = newtons_method(coef, compute_grads_and_hess, self.tol, self.max_iter,
+                         conds)
+    if self.model.warm_start:
+      self._warm_start_coefs = (warm_start_key,
+                                dict(zip(slice_keys, res.copy())))
+    if self.fit_intercept:
+      # Make intercept the 1st column.
+      res = np.roll(res, 1, axis=1)
+    xs = get_coef_names(tuple(xs[:k - self.fit_intercept]), self.fit_intercept)
     if split_by:
       df = pd.DataFrame(conds, columns=split_by)
       if len(split_by) == 1:
         idx = pd.Index(df[split_by[0]])
       else:
         idx = pd.MultiIndex.from_frame((df))
-      res = pd.DataFrame(res, columns=xs, index=idx)
-      if self.fit_intercept:
-        res.columns = list(res.columns[:-1]) + ['intercept']
-        # Make intercept the 1st column.
-        xs = ['intercept'] + xs[:-1]
-        res = res[xs]
-      res.sort_index(inplace=True)
-      return res
-    res = res[0]
-    if self.fit_intercept:
-      res = np.concatenate([[res[-1]], res[:-1]])
-      xs = ['intercept'] + xs[:-1]
-    return pd.DataFrame([res], columns=xs)
+      return pd.DataFrame(res, columns=xs, index=idx).sort_index()
+    return pd.DataFrame(res, columns=xs)
+
 
+def sig_minus_b(z, b, exp_z=None, exp_nz=None):
+  """Computes sigmoid(z) - b in a numerically stable way in SQL.
 
-def sig_minus_b(z, b):
-  """Computes sigmoid(z) - b in a numerically stable way in SQL."""
+  Args:
+    z: The SQL expression of z.
+    b: The SQL expression of b.
+    exp_z: The SQL expression of EXP(z), if it's already available. Only used
+      when z < 0.
+    exp_nz: The SQL expression of EXP(-z), if it's already available. Only
+      used when z >= 0.
+
+  Returns:
+    The SQL expression of sigmoid(z) - b.
+  """
   # Adapted from http://fa.bianp.net/blog/2019/evaluate_logistic
-  exp_z = f'EXP({z})'
-  exp_nz = f'EXP(-({z}))'
+  exp_z = exp_z or f'EXP({z})'
+  exp_nz = exp_nz or f'EXP(-({z}))'
   return ('IF({z} < 0, ((1 - {b}) * {exp_z} - {b}) / (1 + {exp_z}), ((1 - {b}) '
           '- {b} * {exp_nz}) / (1 + {exp_nz}))').format(
               z=z, b=b, exp_z=exp_z, exp_nz=exp_nz)
 
 
-def newtons_method(coef, grads, hess, tol, max_iter, conds, *args):
-  """Uses Newton's method to optimize coef on n slices at the same time."""
+def newtons_method(coef, grads_and_hess, tol, max_iter, conds, *args):
+  """Uses Newton's method to optimize coef on n slices at the same time.
+
+  Args:
+    coef: A n*k array of the initial coefficients, where n is the number of
+      slices and k is the number of features. It's updated in place.
+    grads_and_hess: A function that takes coef, a boolean array indicating
+      which slices have converged and args. It returns the m*k gradients and
+      the m*k*k Hessian matrices of the m slices that haven't converged, so
+      both can be computed together.
+    tol: The tolerance of the Newton step size to stop the optimization.
+    max_iter: The maximum number of iterations.
+    conds: The slices, used in the warning when some slices don't converge.
+    *args: Additional args passed to grads and hess.
+
+  Returns:
+    The optimized coefficients.
+  """
   n_slice = len(coef)
-  converged = np.array([False] * n_slice)
+  converged = np.zeros(n_slice, dtype=bool)
+  last_step = np.full(n_slice, np.inf)
   for _ in range(int(max_iter)):
-    h = hess(coef, converged, *args)
-    j = grads(coef, converged, *args)
-    for i in range(n_slice):
-      if not converged[i]:
-        delta = np.linalg.solve(h[i], j[i])
-        if abs(delta).max() < tol:
-          converged[i] = True
-        coef[i] -= delta
-    if all(converged):
+    j, h = grads_and_hess(coef, converged, *args)
+    active = ~converged
+    # The Hessian of the logistic loss is positive semi-definite.
+    delta = solve_psd(h, j)
+    coef[active] -= delta
+    step = abs(delta).max(axis=1)
+    # Each iteration costs a scan of the data so we also stop a slice when the
+    # next step is predicted to be below tol. Assuming the steps shrink at least
+    # at the rate of the last two steps, the next one is at most
+    # step * step / last_step. It's conservative for Newton's method, which
+    # converges quadratically.
+    prev = last_step[active]
+    shrinking = np.isfinite(prev) & (step < prev)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      predicted = np.where(shrinking, step * step / prev, np.inf)
+    converged[active] = (step < tol) | (predicted < tol)
+    last_step[active] = step
+    if converged.all():
       return coef
   if n_slice == 1:
     print("WARNING: Optimization didn't converge!")
@@ -884,22 +1315,53 @@ def newtons_method(coef, grads, hess, tol, max_iter, conds, *args):
   return coef
 
 
-def count_features(m: metrics.Metric):
-  """Gets the width of the result of m.compute_on()."""
-  if isinstance(m, Model):
-    return m.k
-  if isinstance(m, metrics.MetricList):
-    return sum([count_features(i) for i in m])
-  if isinstance(m, operations.MetricWithCI):
-    return count_features(
-        m.children[0]) * 3 if m.confidence else count_features(
-            m.children[0]) * 2
-  if isinstance(m, operations.Operation):
-    return count_features(m.children[0])
-  if isinstance(m, metrics.CompositeMetric):
-    return max([count_features(i) for i in m.children])
-  if isinstance(m, metrics.Quantile):
-    if m.one_quantile:
-      return 1
-    return len(m.quantile)
-  return 1
+def count_features(m: metrics.Metric, memo=None):
+  """Gets the width of the result of m.compute_on().
+
+  Args:
+    m: A Metric.
+    memo: A dict of the widths of the Metrics that have been counted, keyed by
+      id, so a Metric shared by several branches of the tree is only counted
+      once. It only lives for one call because Metrics can be mutated later.
+
+  Returns:
+    The number of columns in the result of m.compute_on().
+  """
+  if memo is None:
+    memo = {}
+  if id(m) not in memo:
+    memo[id(m)] = _count_features(m, memo)
+  return memo[id(m)]
+
+
+def _count_quantile_features(m, memo):
+  del memo  # unused
+  return 1 if m.one_quantile else len(m.quantile)
+
+
+# Keyed by class and looked up along the MRO of the Metric so a subclass uses
+# the handler of its closest registered ancestor.
+_FEATURE_COUNTERS = {
+    Model: lambda m, memo: m.k,
+    metrics.MetricList: lambda m, memo: sum(
+        count_features(i, memo) for i in m),
+    operations.MetricWithCI: lambda m, memo: count_features(
+        m.children[0], memo) * (3 if m.confidence else 2),
+    operations.Operation: lambda m, memo: count_features(m.children[0], memo),
+    metrics.CompositeMetric: lambda m, memo: max(
+        count_features(i, memo) for i in m.children),
+    metrics.Quantile: _count_quantile_features,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _get_feature_counter(cls):
+  for c in cls.__mro__:
+    if c in _FEATURE_COUNTERS:
+      return _FEATURE_COUNTERS[c]
+  return None
+
+
+def _count_features(m, memo):
+  counter = _get_feature_counter(type(m))
+  return counter(m, memo) if counter else 1
@@ -13,6 +13,10 @@
 # limitations under the License.
 """Tests for meterstick.v2.models."""
 
+import contextlib
+import io
+import sqlite3
+
 from absl.testing import absltest
 from absl.testing import parameterized
 from meterstick import metrics
@@ -279,6 +283,198 @@ class LogisticRegressionTest(absltest.TestCase):
     pd.testing.assert_frame_equal(output, expected)
 
 
+rand = np.random.RandomState(42)
+n_sql = 200
+SQL_DF = pd.DataFrame({
+    'X1': rand.random(n_sql),
+    'X2': rand.random(n_sql) * 3,
+    'Y': rand.randint(0, 100, n_sql),
+    'grp1': rand.choice(['A', 'B', 'C'], n_sql),
+    'grp2': rand.choice(('foo', 'bar'), n_sql),
+    'rid': np.arange(n_sql),
+})
+SQL_DF['Z'] = (SQL_DF.X1 + SQL_DF.X2 * 0.3 + rand.normal(0, 0.5, n_sql) >
+               0.8).astype(int)
+CONN = sqlite3.connect(':memory:')
+CONN.create_function('IF', 3, lambda cond, x, y: x if cond else y)
+CONN.create_function('SAFE_DIVIDE', 2,
+                     lambda x, y: None if x is None or not y else x / y)
+SQL_DF.to_sql('T', CONN, index=False)
+
+
+def execute(query):
+  return pd.read_sql(query, CONN)
+
+
+class MagicModeTest(parameterized.TestCase):
+
+  def test_cache(self):
+    queries = []
+
+    def execute_and_count(query):
+      queries.append(query)
+      return execute(query)
+
+    df = SQL_DF.copy()
+    df.to_sql('CacheTest', CONN, index=False, if_exists='replace')
+    m = models.Ridge(metrics.Sum('Y'), [metrics.Sum('X1'), metrics.Sum('X2')],
+                     'rid')
+    output = m.compute_on_sql(
+        'CacheTest', 'grp1', execute_and_count, mode='magic', cache_key='foo')
+    n_queries = len(queries)
+    cached = m.compute_on_sql(
+        'CacheTest', 'grp1', execute_and_count, mode='magic', cache_key='foo')
+    self.assertLen(queries, n_queries)
+    pd.testing.assert_frame_equal(cached, output)
+
+    df['Y'] = df.Y * 2 + df.X1
+    df.to_sql('CacheTest', CONN, index=False, if_exists='replace')
+    for flush in (lambda: m.flush_cache('foo', ['grp1']), m.flush_cache):
+      flush()
+      self.assertEqual(m.cache, {})
+      output = m.compute_on_sql(
+          'CacheTest', 'grp1', execute, mode='magic', cache_key='foo')
+      expected = m.compute_on(df, 'grp1')
+      pd.testing.assert_frame_equal(
+          output, expected, check_dtype=False, check_index_type=False)
+
+  @parameterized.product(
+      model=(models.LinearRegression, models.Ridge),
+      fit_intercept=(True, False),
+      split_by=(None, 'grp1', ['grp1', 'grp2']))
+  def test_regression(self, model, fit_intercept, split_by):
+    m = model(
+        metrics.Sum('Y'),
+        [metrics.Sum('X1'), metrics.Mean('X2'), metrics.Dot('X1', 'X2')],
+        'rid',
+        fit_intercept=fit_intercept)
+    output = m.compute_on_sql('T', split_by, execute, mode='magic')
+    expected = m.compute_on(SQL_DF, split_by)
+    pd.testing.assert_frame_equal(
+        output, expected, check_dtype=False, check_index_type=False)
+
+  @parameterized.product(
+      model=(models.LinearRegression, models.Ridge),
+      fit_intercept=(True, False),
+      split_by=(None, 'grp1', ['grp1', 'grp2']))
+  def test_normalize(self, model, fit_intercept, split_by):
+    m = model(
+        metrics.Sum('Y'), [metrics.Sum('X1'), metrics.Mean('X2')],
+        'rid',
+        fit_intercept=fit_intercept,
+        normalize=True)
+    output = m.compute_on_sql('T', split_by, execute, mode='magic')
+    expected = m.compute_on(SQL_DF, split_by)
+    pd.testing.assert_frame_equal(
+        output, expected, check_dtype=False, check_index_type=False)
+
+  @parameterized.named_parameters(
+      ('no_split_by', None, None), ('split_by', 'grp1', None),
+      ('split_by_multiple', ['grp1', 'grp2'], None),
+      ('where', 'grp2', 'grp1 != "C"'))
+  def test_logistic_regression(self, split_by, where):
+    m = models.LogisticRegression(
+        metrics.Sum('Z'), [metrics.Sum('X1'), metrics.Sum('X2')],
+        'rid',
+        tol=1e-8,
+        where=where)
+    output = m.compute_on_sql('T', split_by, execute, mode='magic')
+    expected = m.compute_on(SQL_DF, split_by)
+    pd.testing.assert_frame_equal(
+        output, expected, check_dtype=False, check_index_type=False)
+
+  @parameterized.named_parameters(('no_split_by', None),
+                                  ('split_by', 'grp1'))
+  def test_logistic_regression_l1(self, split_by):
+    m = models.LogisticRegression(
+        metrics.Sum('Z'), [metrics.Sum('X1'), metrics.Sum('X2')],
+        'rid',
+        penalty='l1',
+        tol=1e-8)
+    output = m.compute_on_sql('T', split_by, execute, mode='magic')
+    saga = models.LogisticRegression(
+        metrics.Sum('Z'), [metrics.Sum('X1'), metrics.Sum('X2')],
+        'rid',
+        penalty='l1',
+        solver='saga',
+        tol=1e-12,
+        max_iter=100000)
+    expected = saga.compute_on(SQL_DF, split_by)
+    pd.testing.assert_frame_equal(
+        output, expected, check_dtype=False, check_index_type=False)
+
+  def test_logistic_regression_l1_smoothed_to_zero(self):
+    # The penalty is strong enough to set all the coefficients, except the
+    # intercept, to 0. Then the intercept is the log odds of Z.
+    m = models.LogisticRegression(
+        metrics.Sum('Z'), [metrics.Sum('X1'), metrics.Sum('X2')],
+        'rid',
+        penalty='l1',
+        C=0.02,
+        tol=1e-8)
+    output = m.compute_on_sql('T', None, execute, mode='magic')
+    p = SQL_DF.Z.mean()
+    self.assertAlmostEqual(output.iloc[0, 0], np.log(p / (1 - p)))
+    np.testing.assert_array_less(abs(output.iloc[0, 1:].values), m.tol)
+
+  @parameterized.named_parameters(
+      ('no_split_by', None, 'l2'), ('split_by', 'grp1', 'l2'),
+      ('no_penalty', 'grp1', 'none'))
+  def test_logistic_regression_fixed_hessian(self, split_by, penalty):
+    x = [metrics.Sum('X1'), metrics.Sum('X2')]
+    m = models.LogisticRegression(
+        metrics.Sum('Z'), x, 'rid', penalty=penalty, tol=1e-6)
+    fixed = models.LogisticRegression(
+        metrics.Sum('Z'),
+        x,
+        'rid',
+        penalty=penalty,
+        tol=1e-6,
+        max_iter=1000,
+        fixed_hessian=True)
+    output = fixed.compute_on_sql('T', split_by, execute, mode='magic')
+    expected = m.compute_on_sql('T', split_by, execute, mode='magic')
+    # The fixed Hessian converges linearly so the coefficients are only within
+    # a few tol of the optimum when the steps get below tol.
+    pd.testing.assert_frame_equal(output, expected, rtol=0, atol=5 * m.tol)
+
+  def test_logistic_regression_warm_start(self):
+    queries = []
+
+    def execute_and_count(query):
+      queries.append(query)
+      return execute(query)
+
+    x = [metrics.Sum('X1'), metrics.Sum('X2')]
+    m = models.LogisticRegression(
+        metrics.Sum('Z'), x, 'rid', tol=1e-8, warm_start=True)
+    expected = m.compute_on_sql('T', 'grp1', execute_and_count, mode='magic')
+    n_queries = len(queries)
+    queries.clear()
+    output = m.compute_on_sql('T', 'grp1', execute_and_count, mode='magic')
+    self.assertLess(len(queries), n_queries)
+    pd.testing.assert_frame_equal(output, expected)
+
+    # Fits on other data don't start from the coefficients fitted on T.
+    SQL_DF[SQL_DF.grp2 == 'foo'].to_sql(
+        'WarmStartTest', CONN, index=False, if_exists='replace')
+    m = models.LogisticRegression(
+        metrics.Sum('Z'), x, 'rid', max_iter=2, warm_start=True)
+    cold = models.LogisticRegression(metrics.Sum('Z'), x, 'rid', max_iter=2)
+    m.compute_on_sql('T', 'grp1', execute, mode='magic')
+    output = m.compute_on_sql('WarmStartTest', 'grp1', execute, mode='magic')
+    expected = cold.compute_on_sql(
+        'WarmStartTest', 'grp1', execute, mode='magic')
+    pd.testing.assert_frame_equal(output, expected)
+
+    m.compute_on_sql('T', 'grp1', execute, mode='magic')
+    m.where = 'grp2 == "foo"'
+    output = m.compute_on_sql('T', 'grp1', execute, mode='magic')
+    cold.where = 'grp2 == "foo"'
+    expected = cold.compute_on_sql('T', 'grp1', execute, mode='magic')
+    pd.testing.assert_frame_equal(output, expected)
+
+
 class MiscellaneousTests(absltest.TestCase):
 
   def test_model_composition(self):
@@ -337,6 +533,101 @@ class MiscellaneousTests(absltest.TestCase):
     expected = np.array([[1, 2, 3], [2, 4, 5], [3, 5, 6]])
     np.testing.assert_equal(actual, expected)
 
+  def test_symmetrize_triangular_stacked(self):
+    actual = models.symmetrize_triangular([[1, 2, 3], [4, 5, 6]])
+    expected = np.array([[[1, 2], [2, 3]], [[4, 5], [5, 6]]])
+    np.testing.assert_equal(actual, expected)
+
+  def test_symmetrize_triangular_out(self):
+    out = np.zeros((2, 2))
+    actual = models.symmetrize_triangular([1, 2, 3], out)
+    self.assertIs(actual, out)
+    np.testing.assert_equal(out, [[1, 2], [2, 3]])
+
+  def test_solve_psd(self):
+    a = np.array([[[2., 1], [1, 3]]])
+    b = np.array([[1., 2]])
+    np.testing.assert_allclose(models.solve_psd(a, b), [[0.2, 0.6]])
+
+  def test_solve_psd_falls_back_when_cholesky_fails(self):
+    # Not positive definite so dposv fails, but LU can still solve it.
+    a = np.array([[[1., 2], [2, 1]]])
+    b = np.array([[3., 3]])
+    np.testing.assert_allclose(models.solve_psd(a, b), [[1, 1]])
+
+  def test_solve_psd_batched(self):
+    a = np.array([[[2., 1], [1, 3]], [[1., 2], [2, 1]]])
+    b = np.array([[1., 2], [3, 3]])
+    np.testing.assert_allclose(models.solve_psd(a, b), [[0.2, 0.6], [1, 1]])
+
+  def test_solve_psd_singular(self):
+    a = np.array([[[1., 1], [1, 1]]])
+    b = np.array([[1., 2]])
+    with self.assertRaises(np.linalg.LinAlgError):
+      models.solve_psd(a, b)
+
+  def test_solve_normal_equations_warns_ill_conditioned(self):
+    x_t_x = np.array([[[2., 1], [1, 3]], [[1., 1], [1, 1 + 1e-6]]])
+    x_t_y = np.array([[1., 2], [1, 1]])
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+      coef = models.solve_normal_equations(x_t_x, x_t_y)
+    np.testing.assert_allclose(coef, [[0.2, 0.6], [1, 0]], atol=1e-6)
+    # Only the second slice is ill-conditioned.
+    self.assertEqual(out.getvalue().count('WARNING'), 1)
+    self.assertIn("The condition number of X'X is 40000", out.getvalue())
+
+  def test_solve_normal_equations_singular(self):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+      with self.assertRaises(np.linalg.LinAlgError):
+        models.solve_normal_equations(
+            np.array([[[1., 1], [1, 1]]]), np.array([[1., 2]]))
+    self.assertIn("The condition number of X'X is inf", out.getvalue())
+
+  def test_construct_matrix_from_elements(self):
+    x = np.random.RandomState(0).random((2, 10, 3))
+    y = np.random.RandomState(1).random((2, 10))
+    for fit_intercept in (True, False):
+      x_t_x_cols, x_t_y_cols, _, _ = models.get_sufficient_stats_layout(
+          3, fit_intercept)
+      elements = {f'x{i}': x[..., i].mean(1) for i in range(3)}
+      elements['y'] = y.mean(1)
+      for i in range(3):
+        elements[f'x{i}y'] = (x[..., i] * y).mean(1)
+        for j in range(i, 3):
+          elements[f'x{i}x{j}'] = (x[..., i] * x[..., j]).mean(1)
+      elements['grp'] = ['a', 'b']
+      elements = pd.DataFrame(elements)[['grp'] + x_t_x_cols + x_t_y_cols]
+      elements = models.SufficientStats(elements, ['grp'])
+      x_t_x, x_t_y = models.construct_matrix_from_elements(
+          elements, ['X1', 'X2', 'X3'], fit_intercept)
+      x_all = x
+      if fit_intercept:
+        x_all = np.concatenate((np.ones((2, 10, 1)), x), 2)
+      np.testing.assert_allclose(
+          x_t_x, np.einsum('sni,snj->sij', x_all, x_all) / 10)
+      np.testing.assert_allclose(x_t_y, np.einsum('sni,sn->si', x_all, y) / 10)
+
+  def test_newtons_method_stops_early(self):
+    # Fits the log odds of b in each slice. The optimum is log(b / (1 - b)).
+    b = np.array([0.2, 0.6, 0.9, 0.99])
+    expected = np.log(b / (1 - b))
+    for tol in (1e-4, 1e-6, 1e-8):
+      last_coef = np.zeros(len(b))
+
+      def grads_and_hess(coef, converged):
+        active = ~converged
+        last_coef[active] = coef[active, 0]
+        sig = 1 / (1 + np.exp(-coef[active]))
+        return sig - b[active, np.newaxis], (sig * (1 - sig))[..., np.newaxis]
+
+      coef = models.newtons_method(
+          np.zeros((len(b), 1)), grads_and_hess, tol, 100, list(b))
+      np.testing.assert_allclose(coef[:, 0], expected, rtol=0, atol=tol)
+      # Some slices stop before their last step gets below tol.
+      self.assertGreater(max(abs(coef[:, 0] - last_coef)), tol)
+
 
 if __name__ == '__main__':
   absltest.main()
@@ -27,6 +27,7 @@ from meterstick import sql
 from meterstick import utils
 import numpy as np
 import pandas as pd
+from scipy import sparse
 from scipy import stats
 
 
@@ -254,7 +255,8 @@ class CumulativeDistribution(Operation):
     children: A tuple of a Metric whose result we compute the cumulative
       distribution on.
     order: An iterable. The over column will be ordered by it before computing
-      cumsum.
+      cumsum. Values not in order are dropped, and so are the slices that have
+      none of the values in order.
     ascending: Sort ascending or descending.
     And all other attributes inherited from Operation.
   """
@@ -270,10 +272,41 @@ class CumulativeDistribution(Operation):
     super(CumulativeDistribution,
           self).__init__(child, 'Cumulative Distribution of {}', over, **kwargs)
 
+  def compute_on_children(self, children, split_by):
+    """Computes the cumulative distributions of all slices at once."""
+    if self.order:
+      order = list(self.order)
+      if len(set(order)) != len(order):
+        # Duplicated values duplicate the rows so we compute slice by slice.
+        return super(CumulativeDistribution,
+                     self).compute_on_children(children, split_by)
+      rank = pd.Index(order).get_indexer(
+          children.index.get_level_values(self.extra_index[0]))
+      children = children.iloc[rank >= 0]
+      over_codes = [rank[rank >= 0]]
+    else:
+      over_codes = [
+          _get_sort_codes(children.index.get_level_values(o), self.ascending)
+          for o in self.extra_index
+      ]
+    split_codes = [
+        _get_sort_codes(children.index.get_level_values(s)) for s in split_by
+    ]
+    # np.lexsort sorts by the last key first.
+    children = children.iloc[np.lexsort((split_codes + over_codes)[::-1])]
+    if not split_by:
+      return children.cumsum() / children.sum()
+    grouped = children.groupby(level=split_by, sort=False)
+    return grouped.cumsum() / grouped.transform('sum')
+
   def compute(self, df):
     if self.order:
-      df = pd.concat((
-          df.loc[[o]] for o in self.order if o in df.index.get_level_values(0)))
+      ordered = [
+          df.loc[[o]] for o in self.order if o in df.index.get_level_values(0)
+      ]
+      if not ordered:
+        return df.iloc[:0]
+      df = pd.concat(ordered)
     else:
       df.sort_values(self.extra_index, ascending=self.ascending, inplace=True)
     dist = df.cumsum()
@@ -330,6 +363,16 @@ class CumulativeDistribution(Operation):
     return sql.Sql(columns, child_table_alias), with_data
 
 
+def _get_sort_codes(values, ascending=True):
+  """Gets integer codes of values that sort the same way as the values.
+
+  Like in sort_values(), missing values come last regardless of ascending.
+  """
+  codes, uniques = pd.factorize(values, sort=True)
+  n = len(uniques)
+  return np.where(codes < 0, n, codes if ascending else n - 1 - codes)
+
+
 def _get_order_for_cum_dist(over, metric):
   if metric.order:
     over = 'CASE %s\n' % over
@@ -361,6 +404,40 @@ class Comparison(Operation):
     super(Comparison, self).__init__(child, name_tmpl, condition_column,
                                      **kwargs)
 
+  def get_baseline(self, children, split_by):
+    """Gets the baseline values to compare every row of children to.
+
+    The baseline rows are looked up by position so no index alignment is needed
+    when comparing children to them.
+
+    Args:
+      children: The result of the child Metric, indexed by split_by and the
+        condition column(s).
+      split_by: The columns that we use to split the data.
+
+    Returns:
+      base: A numpy array of the same shape as children. Each row holds the
+        baseline values of the slice of the corresponding row of children. The
+        values are NaN if the slice doesn't have a baseline.
+      is_base: A boolean array indicating whether a row of children is the
+        baseline.
+    """
+    idx = children.index
+    conditions = idx.droplevel(split_by) if split_by else idx
+    is_base = conditions.isin([self.baseline_key])
+    base = children[is_base]
+    if base.empty:
+      raise KeyError(self.baseline_key)
+    vals = base.to_numpy()
+    if not split_by:
+      return np.broadcast_to(vals[0], children.shape), is_base
+    pos = base.index.droplevel(self.extra_index).get_indexer(
+        idx.droplevel(self.extra_index))
+    if (pos < 0).any():
+      # Position -1 picks this row of NaN for the slices without a baseline.
+      vals = np.vstack((vals.astype(float), np.full(vals.shape[1], np.nan)))
+    return vals[pos], is_base
+
   def get_sql_and_with_clause(self, table, split_by, global_filter, indexes,
                               local_filter, with_data):
     """Gets the SQL for PercentChange or AbsoluteChange.
@@ -491,18 +568,9 @@ class PercentChange(Comparison):
                          name_tmpl, **kwargs)
 
   def compute_on_children(self, children, split_by):
-    level = None
-    if split_by:
-      level = self.extra_index[0] if len(
-          self.extra_index) == 1 else self.extra_index
-    res = (children / children.xs(self.baseline_key, level=level) - 1) * 100
-    if len(children.index.names) > 1:  # xs might mess up the level order.
-      res = res.reorder_levels(children.index.names)
-    if not self.include_base:
-      to_drop = [i for i in res.index.names if i not in self.extra_index]
-      idx_to_match = res.index.droplevel(to_drop) if to_drop else res.index
-      res = res[~idx_to_match.isin([self.baseline_key])]
-    return res
+    base, is_base = self.get_baseline(children, split_by)
+    res = (children / base - 1) * 100
+    return res if self.include_base else res[~is_base]
 
 
 class AbsoluteChange(Comparison):
@@ -532,21 +600,9 @@ class AbsoluteChange(Comparison):
                                          include_base, name_tmpl, **kwargs)
 
   def compute_on_children(self, children, split_by):
-    level = None
-    if split_by:
-      level = self.extra_index[0] if len(
-          self.extra_index) == 1 else self.extra_index
-    # Don't use "-=". For multiindex it might go wrong. The reason is DataFrame
-    # has different implementations for __sub__ and __isub__. ___isub__ tries
-    # to reindex to update in place which sometimes lead to lots of NAs.
-    res = children - children.xs(self.baseline_key, level=level)
-    if len(children.index.names) > 1:  # xs might mess up the level order.
-      res = res.reorder_levels(children.index.names)
-    if not self.include_base:
-      to_drop = [i for i in res.index.names if i not in self.extra_index]
-      idx_to_match = res.index.droplevel(to_drop) if to_drop else res.index
-      res = res[~idx_to_match.isin([self.baseline_key])]
-    return res
+    base, is_base = self.get_baseline(children, split_by)
+    res = children - base
+    return res if self.include_base else res[~is_base]
 
 
 class PrePostChange(PercentChange):
@@ -1427,7 +1483,11 @@ class MetricWithCI(Operation):
   def get_ci_width(self, stderrs, dof):
     """You can return asymmetrical confidence interval."""
     dof = dof.fillna(0).astype(int)  # Scipy might not recognize the Int64 type.
-    half_width = stderrs * stats.t.ppf((1 + self.confidence) / 2, dof)
+    # dof usually takes only a few distinct values across slices and t.ppf is
+    # slow, so only evaluate it once per distinct value.
+    dof_values, inverse = np.unique(np.asarray(dof), return_inverse=True)
+    multiplier = stats.t.ppf((1 + self.confidence) / 2, dof_values)[inverse]
+    half_width = stderrs * multiplier
     return half_width, half_width
 
   def get_stderrs_or_ci_half_width(self, bucket_estimates):
@@ -1707,7 +1767,7 @@ def get_sum_ct_monkey_patch_fn(unit, original_split_by, original_compute):
     and cache the LOO results.
 
     Args:
-      self: The Sum or Count instance callling this function.
+      self: The Sum or Count instance calling this function.
       df: The DataFrame passed to Sum/Count.compute_slies().
       split_by: The split_by passed to Sum/Count.compute_slies().
 
@@ -1760,7 +1820,7 @@ def get_mean_monkey_patch_fn(unit, original_split_by):
     and cache the LOO results.
 
     Args:
-      self: The Mean instance callling this function.
+      self: The Mean instance calling this function.
       df: The DataFrame passed to Mean.compute_slies().
       split_by: The split_by passed to Mean.compute_slies().
 
@@ -1772,11 +1832,14 @@ def get_mean_monkey_patch_fn(unit, original_split_by):
     if self.weight:
       weighted_var = '_weighted_%s' % self.var
       data[weighted_var] = data[self.var] * data[self.weight]
-      total_sum = self.group(data, split_by)[weighted_var].sum()
-      total_weight = self.group(data, split_by)[self.weight].sum()
-      bucket_sum = self.group(data, split_by_with_unit)[weighted_var].sum()
+      # Reuse the groupings so the keys are only factorized once.
+      grouped = self.group(data, split_by)
+      bucket_grouped = self.group(data, split_by_with_unit)
+      total_sum = grouped[weighted_var].sum()
+      total_weight = grouped[self.weight].sum()
+      bucket_sum = bucket_grouped[weighted_var].sum()
       bucket_sum = utils.adjust_slices_for_loo(bucket_sum, original_split_by)
-      bucket_weight = self.group(data, split_by_with_unit)[self.weight].sum()
+      bucket_weight = bucket_grouped[self.weight].sum()
       bucket_weight = utils.adjust_slices_for_loo(bucket_weight,
                                                   original_split_by)
       loo_sum = total_sum - bucket_sum
@@ -1789,11 +1852,13 @@ def get_mean_monkey_patch_fn(unit, original_split_by):
       loo = loo_sum / loo_weight
       mean = total_sum / total_weight
     else:
-      total_sum = self.group(data, split_by)[self.var].sum()
-      bucket_sum = self.group(data, split_by_with_unit)[self.var].sum()
+      grouped = self.group(data, split_by)[self.var]
+      bucket_grouped = self.group(data, split_by_with_unit)[self.var]
+      total_sum = grouped.sum()
+      bucket_sum = bucket_grouped.sum()
       bucket_sum = utils.adjust_slices_for_loo(bucket_sum, original_split_by)
-      total_ct = self.group(data, split_by)[self.var].count()
-      bucket_ct = self.group(data, split_by_with_unit)[self.var].count()
+      total_ct = grouped.count()
+      bucket_ct = bucket_grouped.count()
       bucket_ct = utils.adjust_slices_for_loo(bucket_ct, original_split_by)
       loo_sum = total_sum - bucket_sum
       loo_ct = total_ct - bucket_ct
@@ -1838,7 +1903,7 @@ def get_dot_monkey_patch_fn(unit, original_split_by, original_compute):
     from the total. Here we precompute and cache the LOO results.
 
     Args:
-      self: The Dot instance callling this function.
+      self: The Dot instance calling this function.
       df: The DataFrame passed to Mean.compute_slies().
       split_by: The split_by passed to Mean.compute_slies().
 
@@ -1859,11 +1924,13 @@ def get_dot_monkey_patch_fn(unit, original_split_by, original_compute):
     else:
       prod = '_meterstick_dot_prod'
       data[prod] = data[self.var] * data[self.var2]
-      total_sum = self.group(data, split_by)[prod].sum()
-      bucket_sum = self.group(data, split_by_with_unit)[prod].sum()
+      grouped = self.group(data, split_by)[prod]
+      bucket_grouped = self.group(data, split_by_with_unit)[prod]
+      total_sum = grouped.sum()
+      bucket_sum = bucket_grouped.sum()
       bucket_sum = utils.adjust_slices_for_loo(bucket_sum, original_split_by)
-      total_ct = self.group(data, split_by)[prod].count()
-      bucket_ct = self.group(data, split_by_with_unit)[prod].count()
+      total_ct = grouped.count()
+      bucket_ct = bucket_grouped.count()
       bucket_ct = utils.adjust_slices_for_loo(bucket_ct, original_split_by)
       loo_sum = total_sum - bucket_sum
       loo_ct = total_ct - bucket_ct
@@ -1912,7 +1979,8 @@ def save_to_cache_for_jackknife(self, key, val, split_by=None):
     split_by: Something can be passed into df.group_by().
   """
   key = self.wrap_cache_key(key, split_by)
-  if isinstance(key.key, tuple) and key.key[:2] == ('_RESERVED', 'jk'):
+  if isinstance(key.key, tuple) and key.key[:2] in (('_RESERVED', 'jk'),
+                                                  ('_RESERVED', 'bootstrap')):
     val = val.copy() if isinstance(val, (pd.Series, pd.DataFrame)) else val
     base_key = key.key[2]
     base_key = utils.CacheKey(base_key, key.where, key.split_by, key.slice_val)
@@ -1923,6 +1991,32 @@ def save_to_cache_for_jackknife(self, key, val, split_by=None):
   self.cache[key] = val
 
 
+def is_precomputable(metric):
+  """Checks if Jackknife and Bootstrap can precompute on metric.
+
+  Both of them precompute by summing the per-row or per-unit terms of Sum,
+  Count, Dot and Mean, so all the leaf Metrics must be of those types and bare.
+  Kwargs like skipna=False or min_count change how the terms add up.
+
+  Args:
+    metric: The Jackknife or Bootstrap instance.
+
+  Returns:
+    If the leaf Metrics of metric can be precomputed.
+  """
+  for m in metric.traverse():
+    if isinstance(m, Operation) and not m.precomputable_in_jk:
+      return False
+    if not m.children and not isinstance(
+        m, (metrics.Sum, metrics.Count, metrics.Mean, metrics.Dot)):
+      return False
+    if isinstance(m, metrics.Count) and m.distinct:
+      return False
+    if isinstance(m, metrics.SimpleMetric) and m.kwargs:
+      return False
+  return True
+
+
 class Jackknife(MetricWithCI):
   """Class for Jackknife estimates of standard errors.
 
@@ -2088,17 +2182,7 @@ class Jackknife(MetricWithCI):
 
   def can_precompute(self):
     """If all leaf Metrics are Sum/Count/Dot/Mean, LOO can be precomputed."""
-    if not self.enable_optimization:
-      return False
-    for m in self.traverse():
-      if isinstance(m, Operation) and not m.precomputable_in_jk:
-        return False
-      if not m.children and not isinstance(
-          m, (metrics.Sum, metrics.Count, metrics.Mean, metrics.Dot)):
-        return False
-      if isinstance(m, metrics.Count) and m.distinct:
-        return False
-    return True
+    return self.enable_optimization and is_precomputable(self)
 
   def compute_children_sql(self, table, split_by, execute, mode, batch_size):
     """Compute the children on leave-one-out data in SQL."""
@@ -2150,6 +2234,122 @@ class Jackknife(MetricWithCI):
     return replicates
 
 
+def get_bootstrap_monkey_patch_fn(samples_key, n_rows, leaves,
+                                  original_compute):
+  """Gets a function that can be monkey patched to leaf Metrics' compute_slices.
+
+  Args:
+    samples_key: The cache_key under which the results on all the bootstrap
+      samples will be cached.
+    n_rows: The length of the DataFrame being bootstrapped.
+    leaves: A list. The patched function appends what is needed to compute the
+      Metric on the bootstrap samples to it.
+    original_compute: The compute_slices() of Sum, Count, Mean or Dot.
+
+  Returns:
+    A function that can be monkey patched to the compute_slices() of
+    Sum/Count/Mean/Dot.
+  """
+
+  def collect_terms(self, df, split_by=None):
+    """Records the per-row terms whose sums over a sample give the result.
+
+    The terms are saved in a sparse matrix whose rows are the rows of the
+    DataFrame being bootstrapped. Its columns are the number of rows followed by
+    the terms from get_bootstrap_terms(), each repeated for every slice. So the
+    counts of how many times each row is drawn in a sample, multiplied by the
+    matrix, gives all the sums needed to compute the Metric on that sample.
+
+    Args:
+      self: The Sum/Count/Mean/Dot instance calling this function.
+      df: The DataFrame passed to compute_slices(). Its column
+        '_meterstick_bootstrap_row' has the positions of the rows in the
+        DataFrame being bootstrapped.
+      split_by: The split_by passed to compute_slices().
+
+    Returns:
+      Same as what normal compute_slices() would have returned.
+    """
+    res = original_compute(self, df, split_by)
+    if split_by:
+      grouped = self.group(df, split_by)
+      codes = grouped.ngroup().values
+      slices = grouped.size().index
+      n_slices = len(slices)
+    else:
+      codes = np.zeros(len(df))
+      slices = None
+      n_slices = 1
+    in_slice = ~np.isnan(codes)
+    terms = [np.ones(len(df))] + get_bootstrap_terms(self, df)
+    terms = np.asarray(terms, dtype=float)[:, in_slice]
+    rows = df['_meterstick_bootstrap_row'].values[in_slice]
+    codes = codes[in_slice].astype(int)
+    cols = np.arange(len(terms))[:, None] * n_slices + codes
+    terms = sparse.csr_matrix(
+        (terms.ravel(), (np.tile(rows, len(terms)), cols.ravel())),
+        shape=(n_rows, len(terms) * n_slices))
+    key = utils.CacheKey(samples_key, self.cache_key.where,
+                         ['_resample_idx'] + split_by)
+    leaves.append((self, key, slices, terms))
+    return res
+
+  return collect_terms
+
+
+def get_bootstrap_terms(metric, df):
+  """Gets the per-row terms whose sums over a sample give the Metric's value."""
+  if isinstance(metric, metrics.Count):
+    return [df[metric.var].notnull()]
+  if isinstance(metric, metrics.Sum):
+    return [df[metric.var].fillna(0)]
+  if isinstance(metric, metrics.Dot):
+    prod = df[metric.var] * df[metric.var2]
+    if metric.normalize:
+      return [prod.fillna(0), prod.notnull()]
+    return [prod.fillna(0)]
+  if metric.weight:
+    # np.average returns NaN if any value or weight is NaN so we count them.
+    weighted = df[metric.var] * df[metric.weight]
+    return [
+        weighted.fillna(0), df[metric.weight].fillna(0),
+        weighted.isnull() | df[metric.weight].isnull()
+    ]
+  return [df[metric.var].fillna(0), df[metric.var].notnull()]
+
+
+def get_bootstrap_estimates(metric, slices, sums):
+  """Computes the Metric on all bootstrap samples from the sums of its terms.
+
+  Args:
+    metric: An instance of Sum, Count, Mean or Dot.
+    slices: The index of the slices the Metric is computed on, or None if there
+      is no split_by.
+    sums: An array of shape (number of terms + 1, number of samples, number of
+      slices). sums[0] is the number of rows drawn for each sample and slice.
+      sums[1:] are the sums of the terms returned by get_bootstrap_terms().
+
+  Returns:
+    A pd.Series of the estimates with an extra '_resample_idx' index level.
+    Slices that don't appear in a sample are left out just like when computing
+    on the sample.
+  """
+  with np.errstate(divide='ignore', invalid='ignore'):
+    estimates = sums[1] / sums[2] if len(sums) > 2 else sums[1]
+  if len(sums) > 3:
+    estimates[sums[3] > 0] = np.nan
+  if slices is None:
+    return pd.Series(
+        estimates[:, 0], pd.RangeIndex(len(estimates), name='_resample_idx'))
+  sample_idx, slice_idx = np.nonzero(sums[0])
+  slices = slices.take(slice_idx)
+  index = pd.MultiIndex.from_arrays(
+      [sample_idx] +
+      [slices.get_level_values(i) for i in range(slices.nlevels)],
+      names=['_resample_idx'] + list(slices.names))
+  return pd.Series(estimates[sample_idx, slice_idx], index)
+
+
 class Bootstrap(MetricWithCI):
   """Class for Bootstrap estimates of standard errors.
 
@@ -2165,6 +2365,9 @@ class Bootstrap(MetricWithCI):
       Additionally, a display() function will be bound to the result so you can
       visualize the confidence interval nicely in Colab and Jupyter notebook.
     children: A tuple of a Metric whose result we bootstrap on.
+    enable_optimization: If all leaf Metrics are Sum, Count, Dot, and Mean, then
+      we can compute them on all the samples at once without materializing the
+      samples.
     And all other attributes inherited from Operation.
   """
 
@@ -2173,33 +2376,197 @@ class Bootstrap(MetricWithCI):
                child: Optional[metrics.Metric] = None,
                n_replicates: int = 10000,
                confidence: Optional[float] = None,
+               enable_optimization=True,
                **kwargs):
     super(Bootstrap, self).__init__(unit, child, confidence, '{} Bootstrap',
                                     None, **kwargs)
     self.n_replicates = n_replicates
+    self.enable_optimization = enable_optimization
 
-  def get_samples(self, df, split_by=None):
+  def get_sample_positions(self, df, split_by=None):
+    """Yields the positions in df of the rows in each bootstrap sample."""
     split_by = [split_by] if isinstance(split_by, str) else split_by or []
     if self.unit is None:
-      to_sample = self.group(df, split_by)
-      for _ in range(self.n_replicates):
-        yield ('_RESERVED', 'Bootstrap', None), to_sample.sample(
-            frac=1, replace=True)
+      for positions in self.resample(np.arange(len(df)), df, split_by):
+        yield positions
     else:
-      grp_by = split_by + [self.unit] if split_by else self.unit
-      grped = df.groupby(grp_by)
-      idx = grped.indices
-      units_split_by = df[grp_by].drop_duplicates()
+      unit_codes, resampled_units = self.get_sample_units(df, split_by)
+      rows = np.flatnonzero(unit_codes >= 0)
+      # The rows of unit u are order[starts[u]:starts[u] + sizes[u]].
+      order = rows[np.argsort(unit_codes[rows], kind='stable')]
+      sizes = np.bincount(unit_codes[rows])
+      starts = np.cumsum(sizes) - sizes
+      for resampled in resampled_units:
+        lengths = sizes[resampled]
+        ends = np.cumsum(lengths)
+        offsets = np.repeat(starts[resampled] - ends + lengths, lengths)
+        yield order[offsets + np.arange(ends[-1])]
+
+  def get_sample_units(self, df, split_by):
+    """Gets the units of the rows in df and the units in each bootstrap sample.
+
+    Args:
+      df: The DataFrame to compute on.
+      split_by: A list of columns that units are resampled within.
+
+    Returns:
+      unit_codes: A np.array with the integer code of the unit each row belongs
+        to, or -1 if the unit or split_by is NaN. A unit is unique within
+        split_by.
+      A generator yielding the codes of the resampled units of each sample.
+    """
+    grp_by = split_by + [self.unit]
+    unit_codes = df.groupby(grp_by).ngroup().values
+    # Rows with NaN in grp_by don't belong to any unit.
+    in_unit = ~np.isnan(unit_codes)
+    unit_codes = np.where(in_unit, unit_codes, -1).astype(int)
+    first = in_unit & ~df[grp_by].duplicated().values
+    return unit_codes, self.resample(unit_codes[first], df[first], split_by)
+
+  def resample(self, values, df, split_by):
+    """Yields values resampled with replacement within each slice.
+
+    It's the same as self.group(df, split_by).sample(frac=1, replace=True), with
+    values in place of the rows of df, but without pandas' overhead per slice.
+    The random draws are the same so seeded results don't change.
+
+    Args:
+      values: A np.array with the same length as df.
+      df: The DataFrame whose slices values are resampled within.
+      split_by: A list of columns to slice df by.
+
+    Yields:
+      The resampled values for each bootstrap sample.
+    """
+    if not split_by:
       for _ in range(self.n_replicates):
-        resampled = self.group(units_split_by, split_by).sample(
-            frac=1, replace=True).values
-        if not split_by:
-          yield ('_RESERVED', 'Bootstrap',
-                 self.unit), df.iloc[np.concatenate([idx[i] for i in resampled
-                                                    ])]
-        else:
-          yield ('_RESERVED', 'Bootstrap', self.unit), df.iloc[np.concatenate(
-              [idx[tuple(i)] for i in resampled])]
+        yield values[np.random.choice(len(values), len(values))]
+      return
+    codes = self.group(df, split_by).ngroup().values
+    # Rows with NaN in split_by are not in any slice.
+    in_slice = np.flatnonzero(~np.isnan(codes))
+    codes = codes[in_slice].astype(int)
+    values = values[in_slice[np.argsort(codes, kind='stable')]]
+    sizes = np.bincount(codes)
+    offsets = np.repeat(np.cumsum(sizes) - sizes, sizes)
+    for _ in range(self.n_replicates):
+      draws = [np.random.choice(size, size) for size in sizes]
+      yield values[np.concatenate(draws) + offsets]
+
+  def get_samples(self, df, split_by=None):
+    for positions in self.get_sample_positions(df, split_by):
+      yield ('_RESERVED', 'Bootstrap', self.unit), df.iloc[positions]
+
+  def compute_children(self,
+                       df: pd.DataFrame,
+                       split_by=None,
+                       melted=False,
+                       return_dataframe=True,
+                       cache_key=None):
+    del melted, return_dataframe, cache_key  # unused
+    if self.can_precompute():
+      rng_state = np.random.get_state()
+      try:
+        return [self.compute_children_on_positions(df, split_by)]
+      except Exception as e:  # pylint: disable=broad-except
+        # Fall back to computing sample by sample, on the same samples, so the
+        # samples that can be computed are salvaged.
+        print('Warning: Failed to precompute %s for reason %s. Computing on '
+              'each sample instead.' % (self.name, repr(e)))
+        np.random.set_state(rng_state)
+    return self.compute_on_samples(self.get_samples(df, split_by), split_by)
+
+  def compute_children_on_positions(self, df, split_by):
+    """Computes the child on all bootstrap samples without materializing them.
+
+    Sum, Count, Dot and Mean on a sample only depend on how many times each row
+    is drawn. So we first compute the child on df, during which the leaf Metrics
+    record the per-row terms they sum over. Then we draw the same samples as
+    get_samples(), count how many times each row, or unit, is drawn and sum the
+    terms over all the samples with a matrix multiplication. The
+    results are cached with an extra '_resample_idx' index level, so at last we
+    can compute the child on ['_resample_idx'] + split_by from the cache.
+
+    Args:
+      df: The DataFrame to compute on.
+      split_by: Something can be passed into df.group_by().
+
+    Returns:
+      A melted DataFrame with one column for each bootstrap sample.
+    """
+    data = df.copy(deep=False)
+    data['_meterstick_bootstrap_row'] = np.arange(len(df))
+    samples_key = ('_RESERVED', 'Bootstrap', self.unit, id(self))
+    leaves = []
+    original_save_to_cache = metrics.Metric.save_to_cache
+    # pytype: disable=attribute-error
+    try:
+      for m in self.traverse():
+        if not m.children:
+          m.compute_slices = get_bootstrap_monkey_patch_fn(
+              samples_key, len(df), leaves, type(m).compute_slices).__get__(m)
+        m.save_to_cache = save_to_cache_for_jackknife.__get__(m)
+      cache_key = self.cache_key or self.RESERVED_KEY
+      cache_key = ('_RESERVED', 'bootstrap', cache_key, samples_key)
+      self.compute_child(data, split_by, cache_key=cache_key)
+    finally:
+      for m in self.traverse():
+        if not m.children:
+          m.compute_slices = type(m).compute_slices.__get__(m)
+        m.save_to_cache = original_save_to_cache.__get__(m)
+    # pytype: enable=attribute-error
+
+    # Count how many times each row is drawn in a batch of samples, then get
+    # the sums of all the terms in the batch with one matrix multiplication.
+    # The batches keep the counts in memory bounded.
+    terms = sparse.hstack([t for _, _, _, t in leaves], format='csr')
+    if self.unit is None:
+      samples = self.get_sample_positions(df, split_by)
+    else:
+      # Units are drawn as a whole so we sum the terms within each unit first
+      # and count how many times each unit is drawn instead.
+      unit_codes, samples = self.get_sample_units(df, split_by)
+      rows = np.flatnonzero(unit_codes >= 0)
+      units = sparse.csr_matrix((np.ones(len(rows)), (unit_codes[rows], rows)),
+                                shape=(unit_codes.max() + 1, len(df)))
+      terms = units @ terms
+    terms = terms.tocsc()
+    n_items = terms.shape[0]
+    sums = np.empty((self.n_replicates, terms.shape[1]))
+    batch = []
+    batch_len = 0
+    start = 0
+    for i, drawn in enumerate(samples):
+      batch.append(drawn)
+      batch_len += len(drawn)
+      if batch_len < 2**22 and i < self.n_replicates - 1:
+        continue
+      sample_idx = np.repeat(np.arange(len(batch)), list(map(len, batch)))
+      counts = np.bincount(
+          sample_idx * n_items + np.concatenate(batch),
+          minlength=len(batch) * n_items).reshape(len(batch), n_items)
+      sums[start:start + len(batch)] = counts @ terms
+      start += len(batch)
+      batch = []
+      batch_len = 0
+
+    col = 0
+    for m, key, slices, leaf_terms in leaves:
+      n_slices = 1 if slices is None else len(slices)
+      leaf_sums = sums[:, col:col + leaf_terms.shape[1]]
+      leaf_sums = leaf_sums.reshape(self.n_replicates, -1, n_slices)
+      estimates = get_bootstrap_estimates(m, slices,
+                                          leaf_sums.transpose(1, 0, 2))
+      m.save_to_cache(key, estimates)
+      m.tmp_cache_keys.add(key)
+      col += leaf_terms.shape[1]
+    replicates = self.compute_child(
+        None, ['_resample_idx'] + split_by, True, cache_key=samples_key)
+    return replicates.unstack('_resample_idx')
+
+  def can_precompute(self):
+    """If all leaf Metrics are Sum/Count/Dot/Mean, samples can be skipped."""
+    return self.enable_optimization and is_precomputable(self)
 
   def compute_children_sql(self, table, split_by, execute, mode, batch_size):
     """Compute the children on resampled data in SQL."""
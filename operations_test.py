@@ -279,6 +279,18 @@ class CumulativeDistributionTests(unittest.TestCase):
     expected.index.name = 'grp'
     testing.assert_frame_equal(output, expected)
 
+  def test_cumulative_distribution_ascending_splitby(self):
+    metric = operations.CumulativeDistribution(
+        'grp', self.sum_x, ascending=False)
+    output = metric.compute_on(self.df, 'country')
+    expected = pd.DataFrame({
+        'Cumulative Distribution of sum(X)': [1., 2. / 3, 1.],
+        'grp': ['A', 'B', 'A'],
+        'country': ['EU', 'US', 'US']
+    })
+    expected.set_index(['country', 'grp'], inplace=True)
+    testing.assert_frame_equal(output, expected)
+
   def test_cumulative_distribution_order_splitby(self):
     metric = operations.CumulativeDistribution('grp', self.sum_x, ('B', 'A'))
     output = metric.compute_on(self.df, 'country')
@@ -290,6 +302,29 @@ class CumulativeDistributionTests(unittest.TestCase):
     expected.set_index(['country', 'grp'], inplace=True)
     testing.assert_frame_equal(output, expected)
 
+  def test_cumulative_distribution_order_splitby_slice_not_in_order(self):
+    # EU has no values in order so it's dropped from the result.
+    metric = operations.CumulativeDistribution('grp', self.sum_x, ('B',))
+    output = metric.compute_on(self.df, 'country')
+    expected = pd.DataFrame({
+        'Cumulative Distribution of sum(X)': [1.],
+        'grp': ['B'],
+        'country': ['US']
+    })
+    expected.set_index(['country', 'grp'], inplace=True)
+    testing.assert_frame_equal(output, expected)
+
+  def test_cumulative_distribution_duplicated_order_slice_not_in_order(self):
+    metric = operations.CumulativeDistribution('grp', self.sum_x, ('B', 'B'))
+    output = metric.compute_on(self.df, 'country')
+    expected = pd.DataFrame({
+        'Cumulative Distribution of sum(X)': [0.5, 1.],
+        'grp': ['B', 'B'],
+        'country': ['US', 'US']
+    })
+    expected.set_index(['country', 'grp'], inplace=True)
+    testing.assert_frame_equal(output, expected)
+
   def test_cumulative_distribution_multiple_metrics(self):
     metric = metrics.MetricList((self.sum_x, metrics.Count('X')))
     metric = operations.CumulativeDistribution('grp', metric)
@@ -456,7 +491,7 @@ class PercentChangeTests(unittest.TestCase):
     metric = operations.PercentChange(['Condition', 'grp'], (0, 'A'),
                                       self.metric_lst)
     output = metric.compute_on(df)
-    df['Condition_and_grp'] = df[['Condition', 'grp']].apply(tuple, 1)
+    df['Condition_and_grp'] = list(zip(df.Condition, df.grp))
     expected_metric = operations.PercentChange('Condition_and_grp', (0, 'A'),
                                                self.metric_lst)
     expected = expected_metric.compute_on(df)
@@ -469,7 +504,7 @@ class PercentChangeTests(unittest.TestCase):
     metric = operations.PercentChange(['Condition', 'grp'], (0, 'A'),
                                       self.metric_lst, True)
     output = metric.compute_on(df)
-    df['Condition_and_grp'] = df[['Condition', 'grp']].apply(tuple, 1)
+    df['Condition_and_grp'] = list(zip(df.Condition, df.grp))
     expected_metric = operations.PercentChange('Condition_and_grp', (0, 'A'),
                                                self.metric_lst, True)
     expected = expected_metric.compute_on(df)
@@ -487,7 +522,7 @@ class PercentChangeTests(unittest.TestCase):
     metric = operations.PercentChange(['Condition', 'grp'], (0, 'A'),
                                       self.metric_lst)
     output = metric.compute_on(df, 'grp2')
-    df['Condition_and_grp'] = df[['Condition', 'grp']].apply(tuple, 1)
+    df['Condition_and_grp'] = list(zip(df.Condition, df.grp))
     expected_metric = operations.PercentChange('Condition_and_grp', (0, 'A'),
                                                self.metric_lst)
     expected = expected_metric.compute_on(df, 'grp2')
@@ -506,7 +541,7 @@ class PercentChangeTests(unittest.TestCase):
     metric = operations.PercentChange(['Condition', 'grp'], (0, 'A'),
                                       self.metric_lst, True)
     output = metric.compute_on(df, 'grp2')
-    df['Condition_and_grp'] = df[['Condition', 'grp']].apply(tuple, 1)
+    df['Condition_and_grp'] = list(zip(df.Condition, df.grp))
     expected_metric = operations.PercentChange('Condition_and_grp', (0, 'A'),
                                                self.metric_lst, True)
     expected = expected_metric.compute_on(df, 'grp2')
@@ -631,6 +666,11 @@ class AbsoluteChangeTests(unittest.TestCase):
     expected.set_index(['grp', 'Condition'], inplace=True)
     testing.assert_frame_equal(output, expected)
 
+  def test_absolute_change_no_baseline(self):
+    metric = operations.AbsoluteChange('Condition', 2, self.metric_lst)
+    with self.assertRaises(KeyError):
+      metric.compute_on(self.df, 'grp')
+
   def test_absolute_change_splitby_melted(self):
     metric = operations.AbsoluteChange('Condition', 0, self.metric_lst, True)
     output = metric.compute_on(self.df, 'grp', melted=True)
@@ -664,7 +704,7 @@ class AbsoluteChangeTests(unittest.TestCase):
     metric = operations.AbsoluteChange(['Condition', 'grp'], (0, 'A'),
                                        self.metric_lst)
     output = metric.compute_on(df)
-    df['Condition_and_grp'] = df[['Condition', 'grp']].apply(tuple, 1)
+    df['Condition_and_grp'] = list(zip(df.Condition, df.grp))
     expected_metric = operations.AbsoluteChange('Condition_and_grp', (0, 'A'),
                                                 self.metric_lst)
     expected = expected_metric.compute_on(df)
@@ -677,7 +717,7 @@ class AbsoluteChangeTests(unittest.TestCase):
     metric = operations.AbsoluteChange(['Condition', 'grp'], (0, 'A'),
                                        self.metric_lst, True)
     output = metric.compute_on(df)
-    df['Condition_and_grp'] = df[['Condition', 'grp']].apply(tuple, 1)
+    df['Condition_and_grp'] = list(zip(df.Condition, df.grp))
     expected_metric = operations.AbsoluteChange('Condition_and_grp', (0, 'A'),
                                                 self.metric_lst, True)
     expected = expected_metric.compute_on(df)
@@ -695,7 +735,7 @@ class AbsoluteChangeTests(unittest.TestCase):
     metric = operations.AbsoluteChange(['Condition', 'grp'], (0, 'A'),
                                        self.metric_lst)
     output = metric.compute_on(df, 'grp2')
-    df['Condition_and_grp'] = df[['Condition', 'grp']].apply(tuple, 1)
+    df['Condition_and_grp'] = list(zip(df.Condition, df.grp))
     expected_metric = operations.AbsoluteChange('Condition_and_grp', (0, 'A'),
                                                 self.metric_lst)
     expected = expected_metric.compute_on(df, 'grp2')
@@ -714,7 +754,7 @@ class AbsoluteChangeTests(unittest.TestCase):
     metric = operations.AbsoluteChange(['Condition', 'grp'], (0, 'A'),
                                        self.metric_lst, True)
     output = metric.compute_on(df, 'grp2')
-    df['Condition_and_grp'] = df[['Condition', 'grp']].apply(tuple, 1)
+    df['Condition_and_grp'] = list(zip(df.Condition, df.grp))
     expected_metric = operations.AbsoluteChange('Condition_and_grp', (0, 'A'),
                                                 self.metric_lst, True)
     expected = expected_metric.compute_on(df, 'grp2')
@@ -796,13 +836,13 @@ class PrePostChangeTests(unittest.TestCase):
   df_agg['interaction'] = df_agg.pre_clicks * df_agg.condition
   x = df_agg[['condition', 'pre_clicks', 'interaction']]
   y = df_agg['clicks']
+  lm = linear_model.LinearRegression().fit(x, y)
 
   def test_basic(self):
     metric = operations.PrePostChange('condition', 0, self.sum_click,
                                       self.sum_preclick, 'cookie')
     output = metric.compute_on(self.df)
-    lm = linear_model.LinearRegression()
-    lm.fit(self.x, self.y)
+    lm = self.lm
     expected = pd.DataFrame([[100 * lm.coef_[0] / lm.intercept_]],
                             columns=['sum(clicks) PrePost Percent Change'],
                             index=[1])
@@ -813,8 +853,7 @@ class PrePostChangeTests(unittest.TestCase):
     metric = operations.PrePostChange('condition', 0, self.sum_click,
                                       self.sum_preclick, 'cookie', True)
     output = metric.compute_on(self.df)
-    lm = linear_model.LinearRegression()
-    lm.fit(self.x, self.y)
+    lm = self.lm
     expected = pd.DataFrame([0, 100 * lm.coef_[0] / lm.intercept_],
                             columns=['sum(clicks) PrePost Percent Change'],
                             index=[0, 1])
@@ -836,13 +875,12 @@ class PrePostChangeTests(unittest.TestCase):
   def test_split_by_multiple(self):
     metric = operations.PrePostChange('condition', 0, self.sum_click,
                                       self.sum_preclick, 'cookie')
-    output = metric.compute_on(self.df, 'grp')
-    expected_a = metric.compute_on(self.df[self.df.grp == 'A'])
-    expected_b = metric.compute_on(self.df[self.df.grp == 'B'])
-    expected_c = metric.compute_on(self.df[self.df.grp == 'C'])
-    expected = pd.concat((expected_a, expected_b, expected_c),
-                         keys=('A', 'B', 'C'),
-                         names=['grp'])
+    df = pd.concat((self.df, self.df), keys=('foo', 'bar'), names=['grp0'])
+    df = df.reset_index('grp0').reset_index(drop=True)
+    output = metric.compute_on(df, ['grp0', 'grp'])
+    bar = metric.compute_on(df[df.grp0 == 'bar'], 'grp')
+    foo = metric.compute_on(df[df.grp0 == 'foo'], 'grp')
+    expected = pd.concat((bar, foo), keys=('bar', 'foo'), names=['grp0'])
     testing.assert_frame_equal(output, expected)
 
   def test_multiple_conditions(self):
@@ -851,7 +889,7 @@ class PrePostChangeTests(unittest.TestCase):
                                       'cookie')
     output = metric.compute_on(self.df)
     df = self.df.copy()
-    df['condition_and_grp'] = df[['condition', 'grp']].apply(tuple, 1)
+    df['condition_and_grp'] = list(zip(df.condition, df.grp))
     expected_metric = operations.PrePostChange('condition_and_grp', (0, 'C'),
                                                self.sum_click,
                                                self.sum_preclick, 'cookie')
@@ -889,7 +927,7 @@ class PrePostChangeTests(unittest.TestCase):
                                          metrics.Sum('impressions'),
                                          self.sum_preclick,
                                          'cookie').compute_on(self.df)
-    expected = pd.concat((expected1, expected2), 1)
+    expected = pd.concat((expected1, expected2), axis=1)
     testing.assert_frame_equal(output, expected)
 
   def test_multiple_covariates(self):
@@ -897,7 +935,7 @@ class PrePostChangeTests(unittest.TestCase):
         'condition', 0, self.sum_click,
         [self.sum_preclick, metrics.Sum('impressions')], 'cookie')
     output = metric.compute_on(self.df)
-    df = self.df.copy()
+    df = self.df
     df_agg = df.groupby(['cookie', 'condition']).sum().reset_index()
     df_agg.pre_clicks = df_agg.pre_clicks - df_agg.pre_clicks.mean()
     df_agg.impressions = df_agg.impressions - df_agg.impressions.mean()
@@ -934,8 +972,8 @@ class PrePostChangeTests(unittest.TestCase):
                                       metrics.MetricList(post), pre,
                                       ['cookie', 'grp1'])
     output = metric.compute_on(df, ['grp2', 'grp3'])
-    df['condition'] = df[['condition1', 'condition2']].apply(tuple, 1)
-    df['agg'] = df[['cookie', 'grp1']].apply(tuple, 1)
+    df['condition'] = list(zip(df.condition1, df.condition2))
+    df['agg'] = list(zip(df.cookie, df.grp1))
 
     expected = [
         operations.PrePostChange('condition', (1, 'C'), m, pre,
@@ -970,11 +1008,12 @@ class PrePostChangeTests(unittest.TestCase):
                                  self.sum_preclick, 'grp2')
     jk = operations.Jackknife('cookie', m)
     output = jk.compute_on(df)
+    cookies = df.cookie.unique()
     loo = []
-    for g in df.cookie.unique():
+    for g in cookies:
       loo.append(m.compute_on(df[df.cookie != g]))
     loo = pd.concat(loo)
-    dof = len(df.cookie.unique()) - 1
+    dof = len(cookies) - 1
     expected = pd.DataFrame(
         [[
             m.compute_on(df).iloc[0, 0],
@@ -988,16 +1027,17 @@ class PrePostChangeTests(unittest.TestCase):
     testing.assert_frame_equal(output, expected)
 
   def test_with_jackknife_with_overlapping_column(self):
-    df = self.df.copy()
+    df = self.df
     m = operations.PrePostChange('condition', 0, self.sum_click,
                                  self.sum_preclick, 'cookie')
     jk = operations.Jackknife('cookie', m)
     output = jk.compute_on(df)
+    cookies = df.cookie.unique()
     loo = []
-    for g in df.cookie.unique():
+    for g in cookies:
       loo.append(m.compute_on(df[df.cookie != g]))
     loo = pd.concat(loo)
-    dof = len(df.cookie.unique()) - 1
+    dof = len(cookies) - 1
     expected = pd.DataFrame(
         [[
             m.compute_on(df).iloc[0, 0],
@@ -1011,7 +1051,7 @@ class PrePostChangeTests(unittest.TestCase):
     testing.assert_frame_equal(output, expected)
 
   def test_display(self):
-    df = self.df.copy()
+    df = self.df
     jk = operations.Jackknife('cookie', confidence=0.9)
     prepost = operations.PrePostChange('condition', 0, self.sum_click,
                                        self.sum_preclick, 'cookie')
@@ -1081,13 +1121,12 @@ class CUPEDTests(unittest.TestCase):
   def test_split_by_multiple(self):
     metric = operations.CUPED('condition', 0, self.sum_click, self.sum_preclick,
                               'cookie')
-    output = metric.compute_on(self.df, 'grp')
-    expected_a = metric.compute_on(self.df[self.df.grp == 'A'])
-    expected_b = metric.compute_on(self.df[self.df.grp == 'B'])
-    expected_c = metric.compute_on(self.df[self.df.grp == 'C'])
-    expected = pd.concat((expected_a, expected_b, expected_c),
-                         keys=('A', 'B', 'C'),
-                         names=['grp'])
+    df = pd.concat((self.df, self.df), keys=('foo', 'bar'), names=['grp0'])
+    df = df.reset_index('grp0').reset_index(drop=True)
+    output = metric.compute_on(df, ['grp0', 'grp'])
+    bar = metric.compute_on(df[df.grp0 == 'bar'], 'grp')
+    foo = metric.compute_on(df[df.grp0 == 'foo'], 'grp')
+    expected = pd.concat((bar, foo), keys=('bar', 'foo'), names=['grp0'])
     testing.assert_frame_equal(output, expected)
 
   def test_multiple_conditions(self):
@@ -1095,7 +1134,7 @@ class CUPEDTests(unittest.TestCase):
                               self.sum_preclick, 'cookie')
     output = metric.compute_on(self.df)
     df = self.df.copy()
-    df['condition_and_grp'] = df[['condition', 'grp']].apply(tuple, 1)
+    df['condition_and_grp'] = list(zip(df.condition, df.grp))
     expected_metric = operations.CUPED('condition_and_grp', (0, 'C'),
                                        self.sum_click, self.sum_preclick,
                                        'cookie')
@@ -1134,7 +1173,7 @@ class CUPEDTests(unittest.TestCase):
     expected2 = operations.CUPED('condition', 0, metrics.Sum('impressions'),
                                  self.sum_preclick,
                                  'cookie').compute_on(self.df)
-    expected = pd.concat((expected1, expected2), 1)
+    expected = pd.concat((expected1, expected2), axis=1)
     testing.assert_frame_equal(output, expected)
 
   def test_multiple_covariates(self):
@@ -1173,8 +1212,8 @@ class CUPEDTests(unittest.TestCase):
     metric = operations.CUPED(['condition1', 'condition2'], (1, 'C'),
                               metrics.MetricList(post), pre, ['cookie', 'grp1'])
     output = metric.compute_on(df, ['grp2', 'grp3'])
-    df['condition'] = df[['condition1', 'condition2']].apply(tuple, 1)
-    df['agg'] = df[['cookie', 'grp1']].apply(tuple, 1)
+    df['condition'] = list(zip(df.condition1, df.condition2))
+    df['agg'] = list(zip(df.cookie, df.grp1))
 
     expected = [
         operations.CUPED('condition', (1, 'C'), m, pre,
@@ -1208,11 +1247,12 @@ class CUPEDTests(unittest.TestCase):
                          'grp2')
     jk = operations.Jackknife('cookie', m)
     output = jk.compute_on(df)
+    cookies = df.cookie.unique()
     loo = []
-    for g in df.cookie.unique():
+    for g in cookies:
       loo.append(m.compute_on(df[df.cookie != g]))
     loo = pd.concat(loo)
-    dof = len(df.cookie.unique()) - 1
+    dof = len(cookies) - 1
     expected = pd.DataFrame(
         [[
             m.compute_on(df).iloc[0, 0],
@@ -1226,16 +1266,17 @@ class CUPEDTests(unittest.TestCase):
     testing.assert_frame_equal(output, expected)
 
   def test_with_jackknife_with_overlapping_column(self):
-    df = self.df.copy()
+    df = self.df
     m = operations.CUPED('condition', 0, self.sum_click, self.sum_preclick,
                          'cookie')
     jk = operations.Jackknife('cookie', m)
     output = jk.compute_on(df)
+    cookies = df.cookie.unique()
     loo = []
-    for g in df.cookie.unique():
+    for g in cookies:
       loo.append(m.compute_on(df[df.cookie != g]))
     loo = pd.concat(loo)
-    dof = len(df.cookie.unique()) - 1
+    dof = len(cookies) - 1
     expected = pd.DataFrame(
         [[
             m.compute_on(df).iloc[0, 0],
@@ -1249,7 +1290,7 @@ class CUPEDTests(unittest.TestCase):
     testing.assert_frame_equal(output, expected)
 
   def test_display(self):
-    df = self.df.copy()
+    df = self.df
     jk = operations.Jackknife('cookie', confidence=0.9)
     prepost = operations.CUPED('condition', 0, self.sum_click,
                                self.sum_preclick, 'cookie')
@@ -1369,7 +1410,7 @@ class MHTests(unittest.TestCase):
     metric = operations.MH(['Condition', 'grp'], (0, 'A'), 'Id',
                            self.metric_lst)
     output = metric.compute_on(df)
-    df['Condition_and_grp'] = df[['Condition', 'grp']].apply(tuple, 1)
+    df['Condition_and_grp'] = list(zip(df.Condition, df.grp))
     expected_metric = operations.MH('Condition_and_grp', (0, 'A'), 'Id',
                                     self.metric_lst)
     expected = expected_metric.compute_on(df)
@@ -1388,7 +1429,7 @@ class MHTests(unittest.TestCase):
     metric = operations.MH(['Condition', 'grp'], (0, 'A'), 'Id',
                            self.metric_lst, True)
     output = metric.compute_on(df)
-    df['Condition_and_grp'] = df[['Condition', 'grp']].apply(tuple, 1)
+    df['Condition_and_grp'] = list(zip(df.Condition, df.grp))
     expected_metric = operations.MH('Condition_and_grp', (0, 'A'), 'Id',
                                     self.metric_lst, True)
     expected = expected_metric.compute_on(df)
@@ -1412,7 +1453,7 @@ class MHTests(unittest.TestCase):
     metric = operations.MH(['Condition', 'grp'], (0, 'A'), 'Id',
                            self.metric_lst)
     output = metric.compute_on(df, 'grp2')
-    df['Condition_and_grp'] = df[['Condition', 'grp']].apply(tuple, 1)
+    df['Condition_and_grp'] = list(zip(df.Condition, df.grp))
     expected_metric = operations.MH('Condition_and_grp', (0, 'A'), 'Id',
                                     self.metric_lst)
     expected = expected_metric.compute_on(df, 'grp2')
@@ -1446,7 +1487,7 @@ class MHTests(unittest.TestCase):
         'platform': ['Desktop'] * 6 + ['Mobile'] * 6,
         'Condition': [0, 0, 0, 1, 1, 1] * 2
     })
-    df['id_platform'] = df[['Id', 'platform']].apply(tuple, axis=1)
+    df['id_platform'] = list(zip(df.Id, df.platform))
     cvr = metrics.Ratio('conversions', 'clicks', 'cvr')
 
     metric = operations.MH('Condition', 0, ['Id', 'platform'], cvr)
@@ -1871,6 +1912,18 @@ class JackknifeTests(unittest.TestCase):
       mock_fn.assert_called_once()
       mock_fn.assert_has_calls([mock.call(df, [])])
 
+  def test_no_precompute_with_kwargs(self):
+    m = metrics.Sum('X', skipna=False)
+    jk = operations.Jackknife('cookie', m)
+    df = pd.DataFrame({
+        'X': range(6),
+        'cookie': [1, 2, 3, 1, 2, 3],
+    })
+    self.assertFalse(jk.can_precompute())
+    output = jk.compute_on(df)
+    expected = operations.Jackknife('cookie', metrics.Sum('X')).compute_on(df)
+    testing.assert_frame_equal(output, expected)
+
   def test_internal_caching_with_two_identical_jackknifes(self):
     df = pd.DataFrame({
         'X': range(6),
@@ -2562,6 +2615,57 @@ class BootstrapTests(unittest.TestCase):
     expected.set_index(['Metric', 'grp'], inplace=True)
     testing.assert_frame_equal(output, expected)
 
+  def test_optimization(self):
+    df = pd.DataFrame({
+        'X': [1, 2, np.nan, 4, 5, 6, 7, 8],
+        'Y': [1, 2, 3, np.nan, 1, 1, 1, 1],
+        'unit': [1, 1, 2, 2, 3, 3, 4, 4],
+        'grp': ['A', 'A', 'B', 'B', 'A', 'B', 'A', 'B']
+    })
+    m = metrics.MetricList((metrics.Count('X'), metrics.Mean('X', 'Y'),
+                            metrics.Dot('X', 'Y', True),
+                            metrics.Sum('X') / metrics.Mean('Y')))
+    change = m | operations.AbsoluteChange('grp', 'A')
+    for unit in (None, 'unit'):
+      for metric in (m, change):
+        for split_by in (None, 'grp'):
+          if metric is change and split_by:
+            continue
+          np.random.seed(42)
+          output = operations.Bootstrap(unit, metric,
+                                        self.n).compute_on(df, split_by)
+          np.random.seed(42)
+          expected = operations.Bootstrap(
+              unit, metric, self.n,
+              enable_optimization=False).compute_on(df, split_by)
+          testing.assert_frame_equal(output, expected)
+
+  def test_optimization_fallback(self):
+    m = operations.Bootstrap(None, self.metric, 10)
+    with mock.patch.object(
+        m, 'compute_children_on_positions', side_effect=ValueError('foo')):
+      with mock.patch('builtins.print') as mock_print:
+        np.random.seed(42)
+        output = m.compute_on(self.df, 'grp')
+    mock_print.assert_called_once_with(
+        'Warning: Failed to precompute MetricList(sum(X), count(X)) Bootstrap '
+        "for reason ValueError('foo'). Computing on each sample instead.")
+    np.random.seed(42)
+    expected = operations.Bootstrap(
+        None, self.metric, 10,
+        enable_optimization=False).compute_on(self.df, 'grp')
+    testing.assert_frame_equal(output, expected)
+
+  def test_no_optimization_with_kwargs(self):
+    m = operations.Bootstrap(None, metrics.Sum('X', min_count=1), 10)
+    self.assertFalse(m.can_precompute())
+    np.random.seed(42)
+    output = m.compute_on(self.df, 'grp')
+    np.random.seed(42)
+    expected = operations.Bootstrap(None, metrics.Sum('X'), 10).compute_on(
+        self.df, 'grp')
+    testing.assert_frame_equal(output, expected)
+
 
 @parameterized.named_parameters(
     ('Distribution', operations.Distribution('condition')),
@@ -2602,7 +2706,7 @@ class FilterTest(parameterized.TestCase):
     output = metric.compute_on(self.df)
     expected1 = op(m1).compute_on(self.df)
     expected2 = op(m2).compute_on(self.df)
-    expected = pd.concat((expected1, expected2), 1)
+    expected = pd.concat((expected1, expected2), axis=1)
     testing.assert_frame_equal(output, expected)
 
   def test_metriclist_child(self, op):
@@ -2623,7 +2727,7 @@ class FilterTest(parameterized.TestCase):
     output = metric.compute_on(self.df)
     expected1 = op(m1).compute_on(self.df[self.df.impressions > 4])
     expected2 = op(m2).compute_on(self.df[self.df.impressions > 4])
-    expected = pd.concat((expected1, expected2), 1)
+    expected = pd.concat((expected1, expected2), axis=1)
     testing.assert_frame_equal(output, expected)
 
 